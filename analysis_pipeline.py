@@ -0,0 +1,217 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from message_encryption import MessageEncryption
+
+# Analysis used when none is given; overridden by SECURE_MESSENGER_ANALYSIS.
+# "sync" classifies a message before it is sent, "async" after it is stored.
+DEFAULT_ANALYSIS_MODE = "sync"
+
+# Messages waiting for the classifier; a sender blocks once this many are queued
+ANALYSIS_QUEUE_SIZE = 64
+
+# Background threads classifying queued messages
+ANALYSIS_WORKERS = 1
+
+# Queued messages a worker classifies with one model call
+ANALYSIS_PIPELINE_BATCH = 16
+
+# Recent durations kept per stage for the percentiles
+LATENCY_SAMPLES = 1024
+
+# Stages timed by the pipeline: the pattern check the sender waits for, the
+# time a sender is blocked by a full queue, classifying and storing a
+# message, and submission to stored analysis
+STAGES = ('check', 'enqueue', 'analysis', 'end_to_end')
+
+
+def open_pipeline(analyzer, storage, mode=None):
+    """Pipeline for the configured analysis mode, or None when messages are analyzed before sending"""
+    mode = mode or os.environ.get("SECURE_MESSENGER_ANALYSIS", DEFAULT_ANALYSIS_MODE)
+    if mode == "sync":
+        return None
+    if mode == "async":
+        return AnalysisPipeline(analyzer, storage)
+    raise ValueError(f"Unknown analysis mode: {mode}")
+
+
+class LatencyRecorder:
+    """Durations of one stage: totals over every sample, percentiles over recent ones"""
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.samples = deque(maxlen=samples)
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        """Record one duration"""
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def summary(self):
+        """Count, mean, median, 95th percentile and maximum in milliseconds"""
+        with self.lock:
+            samples = sorted(self.samples)
+            count, total = self.count, self.total
+
+        def percentile(fraction):
+            return samples[round(fraction * (len(samples) - 1))] * 1000 if samples else 0.0
+
+        return {
+            'count': count,
+            'mean_ms': total / count * 1000 if count else 0.0,
+            'p50_ms': percentile(0.5),
+            'p95_ms': percentile(0.95),
+            'max_ms': samples[-1] * 1000 if samples else 0.0
+        }
+
+
+class AnalysisPipeline:
+    """Classifies sent messages on background workers, off the send path.
+
+    The sender only waits for the pattern check. Stored messages are queued
+    with their shared key; workers classify them in batches and attach the
+    encrypted analysis to the stored record. The queue is bounded, so a
+    sender outpacing the classifier is held back instead of growing it.
+    """
+
+    def __init__(self, analyzer, storage, workers=ANALYSIS_WORKERS,
+                 queue_size=ANALYSIS_QUEUE_SIZE, batch_size=ANALYSIS_PIPELINE_BATCH):
+        self.analyzer = analyzer
+        self.storage = storage
+        self.batch_size = batch_size
+        # (seq, message, shared key, submit time) per queued message
+        self.queue = queue.Queue(queue_size)
+        self.latency = {stage: LatencyRecorder() for stage in STAGES}
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.blocked = 0
+        self.last_error = None
+        self.closed = False
+        self.workers = [threading.Thread(target=self._work, name=f"analysis-{i}", daemon=True)
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def check(self, message):
+        """Pattern-based analysis of a message, for the warning before it is sent"""
+        start = time.perf_counter()
+        # Confidence and type follow once a worker has classified the message
+        analysis = {'suspicious_score': self.analyzer._calculate_suspicious_score(message)}
+        self.latency['check'].add(time.perf_counter() - start)
+        return analysis
+
+    def submit(self, seq, message, key, timeout=None):
+        """Queue a stored message for classification, waiting while the queue is full"""
+        if self.closed:
+            raise ValueError("Analysis pipeline is closed")
+        submitted_at = time.perf_counter()
+        item = (seq, message, key, submitted_at)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.blocked += 1
+            # Raises queue.Full if the timeout passes first
+            self.queue.put(item, timeout=timeout)
+        self.latency['enqueue'].add(time.perf_counter() - submitted_at)
+        with self.lock:
+            self.submitted += 1
+
+    def _work(self):
+        """Worker loop: classify queued messages in batches until a None arrives"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            batch = [item]
+            # Take whatever else is already waiting, without waiting for more
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Leave the stop request for after this batch
+                    self.queue.task_done()
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+            try:
+                self._process(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _process(self, batch):
+        """Classify a batch and attach each analysis to its stored message"""
+        start = time.perf_counter()
+        try:
+            analyses = list(self.analyzer.analyze_messages([message for _, message, _, _ in batch]))
+        except Exception as e:
+            self._failed(len(batch), e)
+            return
+
+        try:
+            # Encrypted with each message's shared key, like the message itself
+            encryption = MessageEncryption()
+            payloads = {}
+            for (seq, _, key, _), analysis in zip(batch, analyses):
+                encryption.set_key(key)
+                payloads[seq] = encryption.encrypt_message(json.dumps(analysis))
+            # One write for the whole batch
+            self.storage.attach_analyses(payloads)
+        except Exception as e:
+            self._failed(len(batch), e)
+            return
+
+        finished = time.perf_counter()
+        for _, _, _, submitted_at in batch:
+            self.latency['analysis'].add((finished - start) / len(batch))
+            self.latency['end_to_end'].add(finished - submitted_at)
+        with self.lock:
+            self.completed += len(batch)
+
+    def _failed(self, count, error):
+        with self.lock:
+            self.failed += count
+            self.last_error = str(error)
+
+    def drain(self):
+        """Wait until every queued message has been analyzed"""
+        self.queue.join()
+
+    def close(self):
+        """Stop accepting messages, finish the queued ones and stop the workers"""
+        if self.closed:
+            return
+        self.closed = True
+        self.drain()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def stats(self):
+        """Queue depth, message counts and per-stage latencies"""
+        with self.lock:
+            counts = {
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'blocked': self.blocked,
+                'last_error': self.last_error
+            }
+        return dict(counts, queued=self.queue.qsize(), capacity=self.queue.maxsize,
+                    workers=len(self.workers),
+                    latency={stage: recorder.summary() for stage, recorder in self.latency.items()})
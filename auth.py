@@ -1,58 +1,130 @@
-import hashlib
-import json
-import os
 from datetime import datetime
 
+from password_hashing import PasswordHasher
+from session import SessionManager
+from storage import open_storage
+from user_activity import ActivityTracker
+
 class UserAuth:
-    def __init__(self):
-        self.users_file = "users.json"
+    def __init__(self, storage=None, hasher=None):
+        self.storage = storage or open_storage()
+        # scrypt on a worker pool; also verifies legacy SHA-256 hashes
+        self.hasher = hasher or PasswordHasher()
+        # Last-login times are written behind, apart from the credentials
+        self.activity = ActivityTracker(self.storage)
+        self.sessions = SessionManager()
         self.load_users()
 
     def load_users(self):
-        """Load existing users from JSON file"""
-        if os.path.exists(self.users_file):
-            with open(self.users_file, 'r') as f:
-                self.users = json.load(f)
-        else:
-            self.users = {}
+        """Load existing users from storage"""
+        self.users = self.storage.load_users()
 
     def save_users(self):
-        """Save users to JSON file"""
-        with open(self.users_file, 'w') as f:
-            json.dump(self.users, f)
+        """Save all users to storage"""
+        self.storage.save_users(self.users)
+
+    def save_user(self, username):
+        """Save one user's record to storage"""
+        self.storage.save_user(username, self.users[username])
 
     def register_user(self, username, password):
         """Register a new user with password hashing"""
+        # Pick up users registered by other running instances
+        self.load_users()
         if username in self.users:
             return False, "Username already exists"
-        
-        # Hash the password using SHA-256
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        
-        # Store user data
-        self.users[username] = {
+        return self._add_user(username, self.hasher.hash(password))
+
+    async def register_user_async(self, username, password):
+        """Register a new user, hashing the password off the event loop"""
+        self.load_users()
+        if username in self.users:
+            return False, "Username already exists"
+        return self._add_user(username, await self.hasher.hash_async(password))
+
+    def _add_user(self, username, hashed_password):
+        # Store user data; another instance may have taken the name since
+        # the check, so the storage backend makes the final decision
+        record = {
             'password': hashed_password,
             'created_at': datetime.now().isoformat(),
             'last_login': None
         }
-        self.save_users()
+        if not self.storage.add_user(username, record):
+            self.load_users()
+            return False, "Username already exists"
+        self.users[username] = record
         return True, "Registration successful"
 
+    def user_exists(self, username):
+        """Check whether a user is registered"""
+        if username not in self.users:
+            # Pick up users registered by other running instances
+            self.load_users()
+        return username in self.users
+
+    def check_password(self, username, password):
+        """Check a user's password without recording a login"""
+        if not self.user_exists(username):
+            return False
+        return self.hasher.verify(password, self.users[username]['password'])
+
     def verify_user(self, username, password):
         """Verify user credentials"""
-        if username not in self.users:
+        if not self.user_exists(username):
             return False, "User not found"
         
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        if self.users[username]['password'] == hashed_password:
-            # Update last login time
-            self.users[username]['last_login'] = datetime.now().isoformat()
-            self.save_users()
-            return True, "Login successful"
-        return False, "Invalid password"
-
-    def validate_session(self, username):
+        hashed_password = self.users[username]['password']
+        if not self.hasher.verify(password, hashed_password):
+            return False, "Invalid password"
+        if self.hasher.needs_rehash(hashed_password):
+            self._upgrade_hash(username, self.hasher.hash(password))
+        return self._record_login(username)
+
+    async def verify_user_async(self, username, password):
+        """Verify user credentials, hashing off the event loop"""
+        if not self.user_exists(username):
+            return False, "User not found"
+        
+        hashed_password = self.users[username]['password']
+        if not await self.hasher.verify_async(password, hashed_password):
+            return False, "Invalid password"
+        if self.hasher.needs_rehash(hashed_password):
+            self._upgrade_hash(username, await self.hasher.hash_async(password))
+        return self._record_login(username)
+
+    def _upgrade_hash(self, username, hashed_password):
+        # Legacy SHA-256 or outdated cost parameters: store the new hash now
+        # that the plain password is known to be right
+        self.users[username]['password'] = hashed_password
+        self.save_user(username)
+
+    def _record_login(self, username):
+        # Update last login time
+        last_login = datetime.now().isoformat()
+        self.users[username]['last_login'] = last_login
+        self.activity.record_login(username, last_login)
+        return True, "Login successful"
+
+    def login(self, username, password):
+        """Verify credentials and start a session, returning (success, message, token)"""
+        success, message = self.verify_user(username, password)
+        token = self.sessions.create(username) if success else None
+        return success, message, token
+
+    def logout(self, token):
+        """End a session"""
+        self.sessions.end(token)
+
+    def validate_session(self, token):
         """Validate if user session is active"""
-        if username not in self.users:
-            return False
-        return True 
\ No newline at end of file
+        return self.sessions.validate(token) is not None
+
+    def session_stats(self):
+        """Hit rate, evictions and live session count of the session table"""
+        return self.sessions.stats()
+
+    def close(self):
+        """Write pending login times to storage and stop the hashing workers"""
+        self.activity.close()
+        self.hasher.close()
@@ -0,0 +1,877 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import cycle
+
+from blob_store import BlobStore
+from message_encryption import MessageEncryption, xor_keystream
+from message_store import MessageStore
+from text_preprocessor import TextPreprocessor
+from pattern_matcher import DEFAULT_PATTERNS, PatternMatcher
+from password_hashing import PBKDF2, PasswordHasher, hash_password
+from auth import UserAuth
+from storage import JSONStorage, SQLiteStorage
+
+SIZE_UNITS = {'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30}
+
+
+def parse_size(text):
+    """Parse a size such as 64KB or 1GB into a byte count"""
+    text = text.strip().upper()
+    for unit, factor in SIZE_UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def format_size(size):
+    """Format a byte count using the largest whole unit"""
+    for unit, factor in sorted(SIZE_UNITS.items(), key=lambda item: -item[1]):
+        if size >= factor:
+            return f"{size / factor:g}{unit}"
+    return f"{size}B"
+
+
+def time_call(func, *args):
+    """Run func once and return (result, elapsed seconds)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def generator_xor(data, key):
+    """The original per-byte generator cipher, kept as the reference"""
+    return bytes(a ^ b for a, b in zip(data, cycle(key)))
+
+
+def bench_xor(args):
+    """Compare the bulk XOR core against the per-byte generator"""
+    key = hashlib.sha256(b'benchmark').digest()
+    generator_limit = parse_size(args.generator_limit)
+
+    print(f"{'Payload':>10} {'Generator MB/s':>16} {'Bulk MB/s':>12} {'Speedup':>10}")
+    for size in map(parse_size, args.sizes):
+        data = os.urandom(size)
+        bulk, bulk_time = time_call(xor_keystream, data, key)
+        bulk_rate = size / (1 << 20) / max(bulk_time, 1e-9)
+
+        if size <= generator_limit:
+            reference, generator_time = time_call(generator_xor, data, key)
+            if reference != bulk:
+                raise AssertionError(f"Bulk output differs from generator at {format_size(size)}")
+            generator_rate = size / (1 << 20) / max(generator_time, 1e-9)
+            print(f"{format_size(size):>10} {generator_rate:>16.1f} {bulk_rate:>12.1f} "
+                  f"{generator_time / max(bulk_time, 1e-9):>9.1f}x")
+        else:
+            print(f"{format_size(size):>10} {'skipped':>16} {bulk_rate:>12.1f} {'-':>10}")
+
+
+def sample_payloads():
+    """Representative payloads: a message envelope, a text document and random bytes"""
+    message = json.dumps({
+        "sender": "alice",
+        "receiver": "bob",
+        "message": "Hi Bob, the quarterly report is attached. Let me know what time "
+                   "works for the review meeting tomorrow and I will book a room.",
+        "timestamp": datetime.now().isoformat(),
+        "analysis": {"type": "question", "confidence": 0.42, "suspicious_score": 0}
+    })
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'README.md'), 'rb') as f:
+        readme = f.read()
+    document = (readme * ((1 << 20) // len(readme) + 1))[:1 << 20]
+    return {
+        'message': message.encode('utf-8'),
+        'document': document,
+        'binary': os.urandom(1 << 20)
+    }
+
+
+def bench_compress(args):
+    """Report size and time for each compression codec and level"""
+    codecs = [(None, None)] + [('zlib', level) for level in (1, 6, 9)] + \
+             [('lzma', level) for level in (0, 6)]
+
+    print(f"{'Payload':>10} {'Codec':>8} {'Stored':>10} {'Ratio':>7} "
+          f"{'Encrypt ms':>11} {'Decrypt ms':>11}")
+    for name, payload in sample_payloads().items():
+        for codec, level in codecs:
+            encryption = MessageEncryption(compression=codec, compression_level=level)
+            encryption.generate_key('benchmark')
+            encrypted, encrypt_time = time_call(encryption.encrypt_message, payload)
+            decrypted, decrypt_time = time_call(encryption.decrypt_message, encrypted)
+            if isinstance(decrypted, str):
+                decrypted = decrypted.encode('utf-8')
+            if decrypted != payload:
+                raise AssertionError(f"Round trip failed for {name} with {codec}")
+            label = f"{codec}-{level}" if codec else 'none'
+            print(f"{name:>10} {label:>8} {len(encrypted):>10} "
+                  f"{len(encrypted) / len(payload):>7.2f} "
+                  f"{encrypt_time * 1000:>11.2f} {decrypt_time * 1000:>11.2f}")
+
+    print()
+    bench_file_memory(parse_size(args.file_size), parse_size(args.max_rss))
+
+
+# Run in a fresh interpreter: encrypt or decrypt one file with zlib
+# compression, then report seconds taken and peak RSS in KB as JSON
+FILE_ROUND_TRIP_HARNESS = """
+import json, resource, sys, time
+from message_encryption import MessageEncryption
+step, source, destination = sys.argv[1:]
+encryption = MessageEncryption(compression='zlib')
+encryption.generate_key('benchmark')
+start = time.perf_counter()
+if step == 'encrypt':
+    encryption.encrypt_file_to(source, destination)
+else:
+    encryption.decrypt_file_to(source, destination)
+elapsed = time.perf_counter() - start
+try:
+    with open('/proc/self/status') as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps([elapsed, rss]))
+"""
+
+
+def file_round_trip_step(step, source, destination):
+    """Seconds and peak RSS in KB for a new process to encrypt or decrypt a file"""
+    import subprocess
+    import sys
+    result = subprocess.run([sys.executable, '-c', FILE_ROUND_TRIP_HARNESS, step, source, destination],
+                            capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_file_memory(file_size, max_rss):
+    """Round-trip a file of zeros and check neither direction's peak memory grows with it"""
+    import filecmp
+    directory = tempfile.mkdtemp(prefix='messenger-compress-')
+    try:
+        source = os.path.join(directory, 'zeros')
+        encrypted = os.path.join(directory, 'zeros.enc')
+        decrypted = os.path.join(directory, 'zeros.dec')
+        with open(source, 'wb') as f:
+            f.truncate(file_size)
+
+        print(f"{'File':>10} {'Step':>8} {'Seconds':>8} {'Peak RSS MB':>12}")
+        for step, step_source, destination in (('encrypt', source, encrypted),
+                                               ('decrypt', encrypted, decrypted)):
+            elapsed, rss = file_round_trip_step(step, step_source, destination)
+            print(f"{format_size(file_size):>10} {step:>8} {elapsed:>8.2f} {rss / 1024:>12.0f}")
+            if rss * 1024 > max_rss:
+                raise AssertionError(f"{step} of {format_size(file_size)} of zeros peaked at "
+                                     f"{rss / 1024:.0f}MB, over {format_size(max_rss)}")
+        if not filecmp.cmp(source, decrypted, shallow=False):
+            raise AssertionError("File round trip failed")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def open_stress_storage(directory):
+    """JSON storage with every file inside one directory"""
+    return JSONStorage(users_file=os.path.join(directory, 'users.json'),
+                       shared_dir=os.path.join(directory, 'shared_files'),
+                       message_store=MessageStore(os.path.join(directory, 'message_log')),
+                       blob_store=BlobStore(os.path.join(directory, 'blobs')),
+                       activity_file=os.path.join(directory, 'user_activity.json'))
+
+
+def bench_logins(args):
+    """Time logins against user databases of increasing size"""
+    # Near-free hashing, so the numbers measure storage rather than the KDF
+    hasher = PasswordHasher(workers=1, algorithm=PBKDF2, pbkdf2_iterations=1)
+    hashed_password = hasher.hash('benchmark')
+    print(f"{'Users':>8} {'Logins/s':>10} {'users.json writes':>18}")
+    for count in args.users:
+        directory = tempfile.mkdtemp(prefix='messenger-logins-')
+        try:
+            storage = open_stress_storage(directory)
+            storage.save_users({f"user{i}": {'password': hashed_password, 'created_at': None,
+                                             'last_login': None} for i in range(count)})
+            auth = UserAuth(storage, hasher=hasher)
+            writes_before = storage.users_writer.flushes
+            start = time.perf_counter()
+            for i in range(args.logins):
+                if not auth.verify_user(f"user{i % count}", 'benchmark')[0]:
+                    raise AssertionError("Login failed")
+            elapsed = time.perf_counter() - start
+            writes = storage.users_writer.flushes - writes_before
+            auth.activity.close()
+            if storage.load_users()[f"user{(args.logins - 1) % count}"]['last_login'] is None:
+                raise AssertionError("Login time was not written on close")
+            storage.close()
+            print(f"{count:>8} {args.logins / elapsed:>10.0f} {writes:>18}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    hasher.close()
+
+
+async def verify_concurrently(hasher, hashed_password, logins):
+    """Check the same password logins times through the async API"""
+    results = await asyncio.gather(*(hasher.verify_async('benchmark', hashed_password)
+                                     for _ in range(logins)))
+    if not all(results):
+        raise AssertionError("Password check failed")
+
+
+def bench_hashing(args):
+    """Password checks per second as the hashing pool grows"""
+    print(f"{os.cpu_count()} CPUs, scrypt n={args.scrypt_n}")
+    hashed_password = hash_password('benchmark', scrypt_n=args.scrypt_n)
+    print(f"{'Workers':>8} {'Pool':>8} {'Logins/s':>10} {'Speedup':>8}")
+    baseline = None
+    for processes in (False, True):
+        for workers in args.workers:
+            hasher = PasswordHasher(workers=workers, scrypt_n=args.scrypt_n, processes=processes)
+            try:
+                # Start the workers before timing
+                hasher.verify('benchmark', hashed_password)
+                _, elapsed = time_call(asyncio.run, verify_concurrently(hasher, hashed_password,
+                                                                       args.logins))
+            finally:
+                hasher.close()
+            rate = args.logins / elapsed
+            baseline = baseline or rate
+            print(f"{workers:>8} {'process' if processes else 'thread':>8} {rate:>10.1f} "
+                  f"{rate / baseline:>7.1f}x")
+
+
+def stress_worker(directory, worker, updates):
+    """Save users and send messages from one process, returning the users.json rewrites it did"""
+    storage = open_stress_storage(directory)
+    try:
+        for i in range(updates):
+            username = f"worker{worker}-user{i}"
+            storage.save_user(username, {'password': '', 'created_at': None, 'last_login': None})
+            storage.append_message(username, f"worker{(worker + 1)}", f"message {i}".encode(),
+                                   datetime.now().isoformat())
+        return storage.users_writer.flushes
+    finally:
+        storage.close()
+
+
+def bench_stress(args):
+    """Write users and messages from many processes at once and check nothing was lost"""
+    directory = tempfile.mkdtemp(prefix='messenger-stress-')
+    try:
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            futures = [executor.submit(stress_worker, directory, worker, args.updates)
+                       for worker in range(args.processes)]
+            flushes = sum(future.result() for future in futures)
+        elapsed = time.perf_counter() - start
+
+        storage = open_stress_storage(directory)
+        try:
+            users = storage.load_users()
+            messages = list(storage.iter_messages())
+        finally:
+            storage.close()
+
+        expected = args.processes * args.updates
+        missing = [f"worker{worker}-user{i}" for worker in range(args.processes)
+                   for i in range(args.updates) if f"worker{worker}-user{i}" not in users]
+        if missing:
+            raise AssertionError(f"{len(missing)} of {expected} user updates lost, e.g. {missing[0]}")
+        if len(messages) != expected:
+            raise AssertionError(f"Expected {expected} messages, found {len(messages)}")
+        if len({message['seq'] for message in messages}) != expected:
+            raise AssertionError("Duplicate message sequence numbers")
+
+        print(f"{args.processes} processes x {args.updates} updates: {expected} users and "
+              f"{expected} messages intact in {elapsed:.2f}s")
+        print(f"users.json rewritten {flushes} times for {expected} updates "
+              f"({expected / max(flushes, 1):.1f} updates per write)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def sample_messages(count):
+    """count messages cycled from the training set"""
+    from train_model import load_training_data
+    messages = load_training_data()['messages']
+    return [f"{messages[i % len(messages)]} ({i})" for i in range(count)]
+
+
+def trained_analyzer(directory):
+    """A MessageAnalyzer trained on the sample data, saving its model into directory"""
+    from message_ml import MessageAnalyzer
+    from train_model import load_training_data
+    analyzer = MessageAnalyzer()
+    analyzer.model_path = os.path.join(directory, 'message_classifier.joblib')
+    analyzer.stats_path = os.path.join(directory, 'message_stats.json')
+    training_data = load_training_data()
+    analyzer.train_model(training_data['messages'], training_data['labels'])
+    return analyzer
+
+
+def legacy_preprocess(text, stop_words_language='english'):
+    """The original nltk.word_tokenize preprocessing, kept as the reference"""
+    import re
+    import nltk
+    text = text.lower()
+    text = re.sub(r'[^a-zA-Z\s]', '', text)
+    tokens = nltk.word_tokenize(text)
+    stop_words = set(nltk.corpus.stopwords.words(stop_words_language))
+    tokens = [token for token in tokens if token not in stop_words]
+    return ' '.join(tokens)
+
+
+def preprocess_corpus(count):
+    """Sample messages plus inputs that exercise tokenizer edge cases"""
+    edge_cases = [
+        "I cannot believe you're gonna do that, wanna bet?",
+        "Gimme a sec, lemme check... gotta go!",
+        "wanna", "CANNOT", "can't won't shouldn't", "d'ye more'n 'tis 'twas",
+        "Ünïcödé İstanbul straße naïve café", "tabs\tand\nnewlines\r\nand\u00a0nbsp",
+        "Call 555-0100 or email bob@example.com before 5pm!!!", "", "   ", "a an the",
+        "\"Quoted\" (parenthesised) [bracketed] {braced} <angled> -- dashes",
+        "She said: 'well...' and left. Next sentence? Yes! Mr. Smith agreed.",
+    ]
+    return edge_cases + sample_messages(count)
+
+
+def bench_preprocess(args):
+    """Check the fast preprocessor against the original and compare latency"""
+    corpus = preprocess_corpus(args.messages)
+    preprocessor = TextPreprocessor()
+
+    legacy, legacy_time = time_call(lambda: [legacy_preprocess(text) for text in corpus])
+    fast, fast_time = time_call(lambda: [preprocessor(text) for text in corpus])
+    mismatches = [(text, old, new) for text, old, new in zip(corpus, legacy, fast) if old != new]
+    if mismatches:
+        text, old, new = mismatches[0]
+        raise AssertionError(f"{len(mismatches)} outputs differ, e.g. {text!r}: {old!r} != {new!r}")
+
+    print(f"{len(corpus)} messages, all outputs identical")
+    print(f"{'original':>10} {legacy_time / len(corpus) * 1e6:>10.1f} us/message")
+    print(f"{'fast':>10} {fast_time / len(corpus) * 1e6:>10.1f} us/message "
+          f"({legacy_time / fast_time:.0f}x)")
+
+
+def legacy_suspicious_score(text, patterns):
+    """The original one substring scan per phrase, kept as the reference"""
+    text = text.lower()
+    return sum(1 for phrases in patterns.values() for phrase in phrases if phrase in text)
+
+
+def synthetic_patterns(count, corpus):
+    """The default phrases plus count phrases of corpus words, spread over their categories"""
+    import random
+    rng = random.Random(0)
+    words = sorted({word for text in corpus for word in text.lower().split() if word.isalpha()})
+    patterns = {category: list(phrases) for category, phrases in DEFAULT_PATTERNS.items()}
+    categories = list(patterns)
+    seen = {phrase for phrases in patterns.values() for phrase in phrases}
+    while len(seen) < count + 14:
+        phrase = ' '.join(rng.choice(words) for _ in range(rng.choice((1, 2, 2, 3))))
+        if phrase not in seen:
+            seen.add(phrase)
+            patterns[rng.choice(categories)].append(phrase)
+    return patterns
+
+
+def bench_patterns(args):
+    """Check the automaton against per-phrase scanning and compare latency as phrases grow"""
+    corpus = preprocess_corpus(args.messages)
+    directory = tempfile.mkdtemp(prefix='messenger-patterns-')
+    try:
+        print(f"{'Phrases':>8} {'Scan us/msg':>12} {'Automaton':>10} {'Speedup':>8} "
+              f"{'Build ms':>9} {'Cached ms':>10}")
+        for count in args.patterns:
+            patterns = synthetic_patterns(count, corpus) if count else DEFAULT_PATTERNS
+            path = os.path.join(directory, f"patterns-{count}.json")
+            with open(path, 'w') as f:
+                json.dump(patterns, f)
+
+            matcher, build_time = time_call(PatternMatcher.load, path)
+            cached, load_time = time_call(PatternMatcher.load, path)
+            legacy, legacy_time = time_call(
+                lambda: [legacy_suspicious_score(text, patterns) for text in corpus])
+            fast, fast_time = time_call(lambda: [matcher.score(text) for text in corpus])
+            if fast != legacy or [cached.score(text) for text in corpus] != legacy:
+                raise AssertionError(f"Automaton scores differ from substring scans with {count} phrases")
+            for text in corpus[:200]:
+                for start, end, _, pattern in matcher.matches(text):
+                    if text.lower()[start:end] != pattern:
+                        raise AssertionError(f"Wrong match position for {pattern!r} in {text!r}")
+
+            phrases = sum(len(phrases) for phrases in patterns.values())
+            print(f"{phrases:>8} {legacy_time / len(corpus) * 1e6:>12.1f} "
+                  f"{fast_time / len(corpus) * 1e6:>10.1f} {legacy_time / fast_time:>7.1f}x "
+                  f"{build_time * 1000:>9.1f} {load_time * 1000:>10.1f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def write_labeled_corpus(path, count):
+    """Write count labeled sample messages as JSONL, returning the distinct (message, label) pairs"""
+    from train_model import load_training_data
+    training_data = load_training_data()
+    pairs = list(zip(training_data['messages'], training_data['labels']))
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            message, label = pairs[i % len(pairs)]
+            f.write(json.dumps({'message': f"{message} ({i})", 'label': label}) + '\n')
+    return pairs
+
+
+def bench_train(args):
+    """Stream a labeled corpus through incremental training and report throughput and memory"""
+    import resource
+    from message_ml import MessageAnalyzer
+    from train_model import iter_labeled_messages
+    directory = tempfile.mkdtemp(prefix='messenger-train-')
+    try:
+        corpus_path = os.path.join(directory, 'corpus.jsonl')
+        pairs = write_labeled_corpus(corpus_path, args.messages)
+        analyzer = MessageAnalyzer()
+        analyzer.model_path = os.path.join(directory, 'message_classifier.joblib')
+        analyzer.stats_path = os.path.join(directory, 'message_stats.json')
+        analyzer.initialize_incremental_model()
+
+        checkpoints = []
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        learned, elapsed = time_call(analyzer.train_incremental, iter_labeled_messages(corpus_path),
+                                     args.batch_size, args.checkpoint_every, checkpoints.append)
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if learned != args.messages:
+            raise AssertionError(f"Learned {learned} of {args.messages} messages")
+
+        predictions = [analysis['type'] for analysis in analyzer.analyze_messages([m for m, _ in pairs])]
+        accuracy = sum(predicted == label for predicted, (_, label) in zip(predictions, pairs)) / len(pairs)
+        print(f"{learned} messages in {elapsed:.1f}s ({learned / elapsed:.0f} messages/s), "
+              f"{len(checkpoints)} checkpoints")
+        # ru_maxrss is in KB on Linux
+        print(f"peak RSS {rss_before / 1024:.0f}MB before training, {rss_after / 1024:.0f}MB after")
+        print(f"training set accuracy {accuracy:.0%}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# Run in a fresh interpreter: import, load and score one message, then
+# report seconds taken and peak RSS in KB as JSON. ru_maxrss can carry the
+# forking parent's peak across exec, so /proc's VmHWM is preferred.
+COLD_START = {
+    'joblib': "import joblib; model = joblib.load(path)",
+    'compact': "from compact_model import CompactModel; model = CompactModel.load(path)"
+}
+COLD_START_HARNESS = """
+import json, resource, sys, time
+path = sys.argv[1]
+start = time.perf_counter()
+{load}
+model.predict_proba(['Hello, how are you?'])
+elapsed = time.perf_counter() - start
+try:
+    with open('/proc/self/status') as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps([elapsed, rss]))
+"""
+
+
+def cold_start(kind, path):
+    """Seconds and peak RSS in KB for a new process to load a model and score a message"""
+    import subprocess
+    import sys
+    code = COLD_START_HARNESS.format(load=COLD_START[kind])
+    result = subprocess.run([sys.executable, '-c', code, path], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_model(args):
+    """Compare cold-start load time and memory of the joblib pipeline and the compact export"""
+    import numpy as np
+    from compact_model import CompactModel
+    directory = tempfile.mkdtemp(prefix='messenger-model-')
+    try:
+        analyzer = trained_analyzer(directory)
+        compact = CompactModel.load(analyzer.compact_path)
+        messages = preprocess_corpus(args.messages)
+        expected = analyzer.pipeline.predict_proba(messages)
+        actual = compact.predict_proba(messages)
+        if list(compact.classes_) != list(analyzer.pipeline.classes_) or \
+                not np.array_equal(expected.argmax(axis=1), actual.argmax(axis=1)) or \
+                not np.allclose(expected, actual, rtol=0, atol=1e-12):
+            raise AssertionError("Compact model predictions differ from the pipeline")
+        print(f"{len(messages)} messages, same predictions "
+              f"(largest probability difference {np.abs(expected - actual).max():.1e})")
+
+        print(f"{'Format':>8} {'File KB':>8} {'Load ms':>8} {'Peak RSS MB':>12}")
+        for kind, path in (('joblib', analyzer.model_path), ('compact', analyzer.compact_path)):
+            runs = [cold_start(kind, path) for _ in range(args.runs)]
+            load_time = min(run[0] for run in runs)
+            rss = min(run[1] for run in runs)
+            print(f"{kind:>8} {os.path.getsize(path) / 1024:>8.0f} {load_time * 1000:>8.0f} "
+                  f"{rss / 1024:>12.0f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# Modules main.py must not import before the classifier is first used
+DEFERRED_MODULES = ('sklearn', 'nltk', 'joblib', 'pandas', 'scipy', 'numpy')
+
+# What importing main.py loaded before those imports were deferred
+EAGER_IMPORTS = ('nltk', 'numpy', 'pandas', 'joblib', 'sklearn.feature_extraction.text',
+                 'sklearn.naive_bayes', 'sklearn.pipeline', 'sklearn.model_selection',
+                 'sklearn.metrics')
+
+
+def import_times(module):
+    """Cumulative -X importtime microseconds per module for a fresh import of module"""
+    import subprocess
+    import sys
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def import_seconds(statement):
+    """Seconds a fresh interpreter takes to run an import statement"""
+    import subprocess
+    import sys
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def bench_imports(args):
+    """Report main.py's import time against eager ML imports, and its heaviest imports"""
+    runs = [import_times('main') for _ in range(args.runs)]
+    times = min(runs, key=lambda run: run['main'])
+    deferred = sorted(name for name in times if name.split('.')[0] in DEFERRED_MODULES)
+    if deferred:
+        raise AssertionError(f"main.py imports {', '.join(deferred[:5])} at startup")
+
+    deferred_time = min(import_seconds("import main") for _ in range(args.runs))
+    eager_time = min(import_seconds(f"import {', '.join(EAGER_IMPORTS)}; import main")
+                     for _ in range(args.runs))
+    print(f"import main: {deferred_time * 1000:.0f} ms, {eager_time * 1000:.0f} ms with the "
+          f"ML imports eager ({(eager_time - deferred_time) * 1000:.0f} ms saved, best of {args.runs})")
+    print(f"none of {', '.join(DEFERRED_MODULES)} imported")
+    top_level = {name: cumulative for name, cumulative in times.items() if '.' not in name}
+    for name, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print(f"{name:>24} {cumulative / 1000:>8.1f} ms")
+
+
+def zipf_messages(count, vocabulary, seed=0):
+    """count messages of 5-20 words drawn from a Zipf-distributed vocabulary"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(5, 21, size=count)
+    ranks = rng.zipf(1.1, size=int(lengths.sum())) % vocabulary
+    words = [f"w{rank}" for rank in ranks.tolist()]
+    messages = []
+    start = 0
+    for length in lengths.tolist():
+        messages.append(' '.join(words[start:start + length]))
+        start += length
+    return messages
+
+
+def traced_build(build):
+    """Result of build() and the memory it still holds, in bytes"""
+    import tracemalloc
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def bench_stats(args):
+    """Top-word accuracy and memory of Space-Saving summaries vs. an exact Counter"""
+    from collections import Counter
+    from message_stats import WORD_PATTERN, MessageStats
+    messages = zipf_messages(args.messages, args.vocabulary)
+    batches = [messages[i:i + 256] for i in range(0, len(messages), 256)]
+
+    def exact_counter():
+        counter = Counter()
+        for batch in batches:
+            counter.update(WORD_PATTERN.findall('\n'.join(batch).lower()))
+        return counter
+
+    (exact, exact_memory), exact_time = time_call(traced_build, exact_counter)
+    truth = exact.most_common(args.top)
+    print(f"{len(messages)} messages, {sum(exact.values())} words, {len(exact)} distinct")
+    print(f"{'Summary':>14} {'Memory KB':>10} {'us/msg':>7} {'Top-10 found':>13} "
+          f"{'Top-' + str(args.top) + ' found':>14} {'Max error':>10}")
+    print(f"{'exact Counter':>14} {exact_memory / 1024:>10.0f} "
+          f"{exact_time / len(messages) * 1e6:>7.1f} {'10/10':>13} "
+          f"{f'{args.top}/{args.top}':>14} {'0.0%':>10}")
+
+    for capacity in args.capacities:
+        def summarize():
+            stats = MessageStats(capacity, windows={})
+            for batch in batches:
+                stats.update(batch)
+            return stats
+
+        (stats, memory), elapsed = time_call(traced_build, summarize)
+        estimated = dict(stats.words.most_common(args.top))
+        top10 = len({word for word, _ in truth[:10]} & set(list(estimated)[:10]))
+        found = len({word for word, _ in truth} & set(estimated))
+        # Reported counts never fall below the truth; worst overestimate among true top words
+        errors = [(stats.words.counts[word] - count) / count for word, count in truth
+                  if word in stats.words.counts]
+        if any(error < 0 for error in errors):
+            raise AssertionError("Space-Saving undercounted a word")
+        if stats.lengths.count != len(messages):
+            raise AssertionError("Message count is wrong")
+        print(f"{'capacity ' + str(capacity):>14} {memory / 1024:>10.0f} "
+              f"{elapsed / len(messages) * 1e6:>7.1f} {f'{top10}/10':>13} "
+              f"{f'{found}/{args.top}':>14} {max(errors, default=0):>10.1%}")
+
+
+def bench_analyze(args):
+    """Compare per-message analysis with batched analysis"""
+    directory = tempfile.mkdtemp(prefix='messenger-analyze-')
+    try:
+        analyzer = trained_analyzer(directory)
+        messages = sample_messages(args.messages)
+
+        single, single_time = time_call(lambda: [analyzer.analyze_message(m) for m in messages])
+        print(f"{'one at a time':>16} {len(messages) / single_time:>10.0f} messages/s")
+        for batch_size in args.batch_sizes:
+            analyzer.analysis_cache.clear()
+            batched, batch_time = time_call(
+                lambda: list(analyzer.analyze_messages(messages, batch_size=batch_size)))
+            if batched != single:
+                raise AssertionError(f"Batched results differ at batch size {batch_size}")
+            print(f"{'batch of ' + str(batch_size):>16} {len(messages) / batch_time:>10.0f} messages/s "
+                  f"({single_time / batch_time:.1f}x)")
+
+        # The send path: analyze, then decide whether to warn. Without the
+        # cache is_suspicious classifies the message a second time.
+        def send_path(pass_analysis):
+            for message in messages:
+                analysis = analyzer.analyze_message(message)
+                analyzer.is_suspicious(message, analysis if pass_analysis else None)
+
+        cache_size = analyzer.cache_size
+        analyzer.cache_size = 0
+        analyzer.analysis_cache.clear()
+        _, uncached_time = time_call(lambda: send_path(False))
+        analyzer.cache_size = cache_size
+        analyzer.analysis_cache.clear()
+        hits, misses = analyzer.cache_hits, analyzer.cache_misses
+        _, cached_time = time_call(lambda: send_path(False))
+        if analyzer.cache_hits - hits != len(messages) or analyzer.cache_misses - misses != len(messages):
+            raise AssertionError("is_suspicious did not reuse the cached analysis")
+        analyzer.analysis_cache.clear()
+        _, passed_time = time_call(lambda: send_path(True))
+        print(f"\n{'send, no cache':>16} {len(messages) / uncached_time:>10.0f} messages/s")
+        print(f"{'send, cached':>16} {len(messages) / cached_time:>10.0f} messages/s "
+              f"({uncached_time / cached_time:.1f}x)")
+        print(f"{'send, passed':>16} {len(messages) / passed_time:>10.0f} messages/s "
+              f"({uncached_time / passed_time:.1f}x)")
+        print(f"cache: {analyzer.cache_stats()}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def open_pipeline_storage(backend, directory):
+    """Storage of the given backend with every file inside directory"""
+    if backend == 'sqlite':
+        return SQLiteStorage(os.path.join(directory, 'messenger.db'),
+                             BlobStore(os.path.join(directory, 'messenger_blobs')))
+    return open_stress_storage(directory)
+
+
+def send_messages(analyzer, storage, encryption, messages, pipeline=None):
+    """Send messages the way main.py does, returning each send's latency in seconds and its seq"""
+    latencies = []
+    seqs = []
+    for message in messages:
+        start = time.perf_counter()
+        analysis = pipeline.check(message) if pipeline else analyzer.analyze_message(message)
+        analyzer.is_suspicious(message, analysis)
+        payload = encryption.encrypt_message(json.dumps({
+            'sender': 'alice', 'receiver': 'bob', 'message': message,
+            'timestamp': datetime.now().isoformat(), 'analysis': analysis
+        }))
+        seq = storage.append_message('alice', 'bob', payload, datetime.now().isoformat())
+        if pipeline:
+            pipeline.submit(seq, message, encryption.key)
+        latencies.append(time.perf_counter() - start)
+        seqs.append(seq)
+    return latencies, seqs
+
+
+def percentiles(latencies):
+    """Median and 95th percentile of a list of seconds, in milliseconds"""
+    ordered = sorted(latencies)
+    return (ordered[len(ordered) // 2] * 1000,
+            ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000)
+
+
+def bench_pipeline(args):
+    """Send latency with the classifier on the send path vs. on background workers"""
+    from analysis_pipeline import AnalysisPipeline
+    from inbox import Inbox
+    from message_encryption import derive_key
+    directory = tempfile.mkdtemp(prefix='messenger-pipeline-')
+    try:
+        analyzer = trained_analyzer(directory)
+        key = derive_key('alice-password' + 'bob-password')
+        encryption = MessageEncryption()
+        encryption.set_key(key)
+        messages = sample_messages(args.messages)
+        expected = [analyzer.analyze_message(message) for message in messages]
+
+        print(f"{'Backend':>8} {'Mode':>6} {'Send p50 ms':>12} {'p95 ms':>8} {'Drain ms':>9} "
+              f"{'Blocked':>8} {'Analysis p95 ms':>16}")
+        for backend in args.backends:
+            for mode in ('sync', 'async'):
+                # Every run classifies from scratch
+                analyzer.analysis_cache.clear()
+                run_directory = os.path.join(directory, f"{backend}-{mode}")
+                os.makedirs(run_directory)
+                storage = open_pipeline_storage(backend, run_directory)
+                pipeline = None
+                if mode == 'async':
+                    pipeline = AnalysisPipeline(analyzer, storage, workers=args.workers,
+                                                queue_size=args.queue_size)
+                latencies, seqs = send_messages(analyzer, storage, encryption, messages, pipeline)
+                _, drain_time = time_call(pipeline.close) if pipeline else (None, 0.0)
+
+                inbox = Inbox(storage, 'bob')
+                inbox.use_key('alice', key)
+                received = [message for page in inbox.pages('alice') for message in page]
+                received.reverse()
+                if [message['message'] for message in received] != messages:
+                    raise AssertionError(f"{backend} {mode}: messages were not stored in order")
+                if [message['analysis'] for message in received] != expected:
+                    raise AssertionError(f"{backend} {mode}: stored analyses differ from synchronous ones")
+
+                send_p50, send_p95 = percentiles(latencies)
+                blocked = analysis_p95 = '-'
+                if pipeline:
+                    stats = pipeline.stats()
+                    if stats['completed'] != len(messages) or stats['failed']:
+                        raise AssertionError(f"{backend}: {stats['completed']} of {len(messages)} "
+                                             f"analyses attached, {stats['failed']} failed")
+                    blocked = stats['blocked']
+                    analysis_p95 = f"{stats['latency']['end_to_end']['p95_ms']:.1f}"
+                print(f"{backend:>8} {mode:>6} {send_p50:>12.2f} {send_p95:>8.2f} "
+                      f"{drain_time * 1000:>9.0f} {blocked:>8} {analysis_p95:>16}")
+                storage.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Secure Messenger performance benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    xor_parser = subparsers.add_parser('xor', help="Bulk XOR core vs. per-byte generator")
+    xor_parser.add_argument('--sizes', nargs='+',
+                            default=['1KB', '64KB', '1MB', '16MB', '256MB', '1GB'])
+    xor_parser.add_argument('--generator-limit', default='64MB',
+                            help="Largest payload to run through the slow generator")
+    xor_parser.set_defaults(func=bench_xor)
+
+    compress_parser = subparsers.add_parser('compress', help="Compress-then-encrypt codec trade-offs")
+    compress_parser.add_argument('--file-size', default='400MB',
+                                 help="Size of the file of zeros round-tripped for the memory check")
+    compress_parser.add_argument('--max-rss', default='128MB',
+                                 help="Peak RSS either direction of the file round trip may reach")
+    compress_parser.set_defaults(func=bench_compress)
+
+    logins_parser = subparsers.add_parser('logins', help="Login throughput vs. number of users")
+    logins_parser.add_argument('--users', nargs='+', type=int, default=[10, 1000, 100000])
+    logins_parser.add_argument('--logins', type=int, default=2000)
+    logins_parser.set_defaults(func=bench_logins)
+
+    hashing_parser = subparsers.add_parser('hashing', help="Password hashing throughput vs. workers")
+    hashing_parser.add_argument('--workers', nargs='+', type=int,
+                                default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    hashing_parser.add_argument('--logins', type=int, default=64)
+    hashing_parser.add_argument('--scrypt-n', type=int, default=1 << 14)
+    hashing_parser.set_defaults(func=bench_hashing)
+
+    preprocess_parser = subparsers.add_parser('preprocess',
+                                              help="Fast preprocessor vs. the original NLTK one")
+    preprocess_parser.add_argument('--messages', type=int, default=5000)
+    preprocess_parser.set_defaults(func=bench_preprocess)
+
+    patterns_parser = subparsers.add_parser('patterns',
+                                            help="Suspicious phrase automaton vs. per-phrase scans")
+    patterns_parser.add_argument('--messages', type=int, default=2000)
+    patterns_parser.add_argument('--patterns', nargs='+', type=int, default=[0, 1000, 10000],
+                                 help="Generated phrases added to the defaults (0 for the defaults alone)")
+    patterns_parser.set_defaults(func=bench_patterns)
+
+    model_parser = subparsers.add_parser('model', help="Joblib pipeline vs. compact model cold start")
+    model_parser.add_argument('--messages', type=int, default=2000)
+    model_parser.add_argument('--runs', type=int, default=3)
+    model_parser.set_defaults(func=bench_model)
+
+    imports_parser = subparsers.add_parser('imports', help="Startup import time of main.py")
+    imports_parser.add_argument('--runs', type=int, default=5)
+    imports_parser.add_argument('--top', type=int, default=10)
+    imports_parser.set_defaults(func=bench_imports)
+
+    stats_parser = subparsers.add_parser('stats', help="Top-word sketch accuracy vs. memory")
+    stats_parser.add_argument('--messages', type=int, default=100000)
+    stats_parser.add_argument('--vocabulary', type=int, default=200000)
+    stats_parser.add_argument('--top', type=int, default=100)
+    stats_parser.add_argument('--capacities', nargs='+', type=int, default=[200, 1000, 5000])
+    stats_parser.set_defaults(func=bench_stats)
+
+    analyze_parser = subparsers.add_parser('analyze', help="Per-message vs. batched vs. cached classification")
+    analyze_parser.add_argument('--messages', type=int, default=5000)
+    analyze_parser.add_argument('--batch-sizes', nargs='+', type=int, default=[16, 256, 1024])
+    analyze_parser.set_defaults(func=bench_analyze)
+
+    pipeline_parser = subparsers.add_parser('pipeline',
+                                            help="Send latency with synchronous vs. background analysis")
+    pipeline_parser.add_argument('--messages', type=int, default=500)
+    pipeline_parser.add_argument('--backends', nargs='+', default=['json', 'sqlite'])
+    pipeline_parser.add_argument('--workers', type=int, default=1)
+    pipeline_parser.add_argument('--queue-size', type=int, default=64)
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    train_parser = subparsers.add_parser('train', help="Incremental training throughput and memory")
+    train_parser.add_argument('--messages', type=int, default=200000)
+    train_parser.add_argument('--batch-size', type=int, default=1000)
+    train_parser.add_argument('--checkpoint-every', type=int, default=50)
+    train_parser.set_defaults(func=bench_train)
+
+    stress_parser = subparsers.add_parser('stress',
+                                          help="Concurrent writers must not lose updates")
+    stress_parser.add_argument('--processes', type=int, default=8)
+    stress_parser.add_argument('--updates', type=int, default=50,
+                               help="Users saved and messages sent by each process")
+    stress_parser.set_defaults(func=bench_stress)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import shutil
+
+from storage_writer import FileLock
+
+# Directory holding content-addressed blobs
+BLOB_DIR = "blobs"
+
+# Bytes hashed per read when adding a file
+HASH_CHUNK_SIZE = 1 << 20
+
+BLOB_SUFFIX = '.blob'
+
+# Reference counts kept by earlier versions; garbage collection removes them
+REFS_SUFFIX = '.refs'
+
+# Serializes writes and garbage collection across processes
+LOCK_FILE = 'blobs.lock'
+
+
+def hash_file(path):
+    """SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Content-addressed blobs, each stored once however often it is shared.
+
+    Blobs carry no reference counts: collect_garbage marks the digests the
+    caller still references and sweeps every other blob.
+    """
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        self.lock = FileLock(os.path.join(root, LOCK_FILE))
+
+    def path(self, digest):
+        """Path of the file holding a blob"""
+        return os.path.join(self.root, digest[:2], digest + BLOB_SUFFIX)
+
+    def exists(self, digest):
+        """Check whether a blob is stored"""
+        return os.path.exists(self.path(digest))
+
+    def put(self, data):
+        """Store bytes once, returning their digest.
+
+        Hold the lock until the reference is recorded, or collect_garbage
+        may delete the blob first.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if not self.exists(digest):
+                path = self.path(digest)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = path + '.tmp'
+                with open(temp_path, 'wb') as file:
+                    file.write(data)
+                os.replace(temp_path, path)
+        return digest
+
+    def put_file(self, source_path):
+        """Move a file into the store, returning its digest.
+
+        The same locking rule as for put applies.
+        """
+        digest = hash_file(source_path)
+        path = self.path(digest)
+        with self.lock:
+            if self.exists(digest):
+                # Identical content is already stored; the new copy is redundant
+                os.remove(source_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                shutil.move(source_path, path)
+        return digest
+
+    def get(self, digest):
+        """Read a blob's bytes"""
+        with open(self.path(digest), 'rb') as file:
+            return file.read()
+
+    def _files(self, suffix):
+        """Yield (digest, path) for every stored file with a suffix"""
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith(suffix):
+                    yield name[:-len(suffix)], os.path.join(directory, name)
+
+    def digests(self):
+        """Yield the digest of every stored blob"""
+        for digest, _ in self._files(BLOB_SUFFIX):
+            yield digest
+
+    def collect_garbage(self, live_references):
+        """Delete every blob whose digest is not in live_references.
+
+        Mark and sweep: the caller marks the digests its messages and files
+        still refer to, with the lock held. Returns the number of blobs deleted.
+        """
+        with self.lock:
+            return self._collect_garbage(live_references)
+
+    def _collect_garbage(self, live_references):
+        deleted = 0
+        for digest, path in list(self._files(BLOB_SUFFIX)):
+            if digest not in live_references:
+                os.remove(path)
+                deleted += 1
+        for _, path in list(self._files(REFS_SUFFIX)):
+            os.remove(path)
+        return deleted
@@ -0,0 +1,145 @@
+import json
+import os
+
+from storage_writer import FileLock, write_json_atomic
+
+# Catalog directory inside the shared files directory
+CATALOG_DIR = ".catalog"
+
+METADATA_SUFFIX = '.metadata'
+INDEXES = {'receiver': 'by_receiver', 'sender': 'by_sender'}
+
+
+def user_key(username):
+    """File-system-safe, case-preserving name for a user's catalog files"""
+    return username.encode('utf-8').hex()
+
+
+class FileCatalog:
+    def __init__(self, shared_dir):
+        self.shared_dir = shared_dir
+        self.root = os.path.join(shared_dir, CATALOG_DIR)
+        # Serializes read-modify-write of index files across processes
+        self.lock = FileLock(os.path.join(self.root, 'catalog.lock'))
+
+    def exists(self):
+        """Check whether the catalog has been built"""
+        return os.path.isdir(os.path.join(self.root, INDEXES['receiver']))
+
+    def _path(self, field, username):
+        return os.path.join(self.root, INDEXES[field], user_key(username) + '.json')
+
+    def _read(self, field, username):
+        try:
+            with open(self._path(field, username), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def add(self, metadata_name, metadata):
+        """Record a metadata file in the receiver and sender indexes"""
+        with self.lock:
+            if not self.exists():
+                # Upgrading from a tree without a catalog: index everything
+                # already shared, including this file
+                self._rebuild()
+                return
+            for field in INDEXES:
+                path = self._path(field, metadata[field])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                entries = self._read(field, metadata[field])
+                entries[metadata_name] = metadata
+                write_json_atomic(path, entries)
+
+    def lookup(self, field, username):
+        """List (metadata file name, metadata) pairs for a receiver or sender"""
+        if not self.exists():
+            self.rebuild()
+        return sorted(self._read(field, username).items(),
+                      key=lambda item: (item[1].get('timestamp', ''), item[0]))
+
+    def scan(self):
+        """Read every metadata file in the shared directory"""
+        entries = {}
+        if not os.path.exists(self.shared_dir):
+            return entries
+        for name in os.listdir(self.shared_dir):
+            if not name.endswith(METADATA_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, name), 'r') as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if all(isinstance(metadata.get(field), str) for field in INDEXES):
+                entries[name] = metadata
+        return entries
+
+    def _catalogued(self):
+        """Read every entry of the receiver index"""
+        entries = {}
+        directory = os.path.join(self.root, INDEXES['receiver'])
+        if not os.path.isdir(directory):
+            return entries
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name), 'r') as f:
+                    entries.update(json.load(f))
+        return entries
+
+    def rebuild(self):
+        """Rebuild both indexes from the metadata files, returning the number of entries"""
+        with self.lock:
+            return self._rebuild()
+
+    def _rebuild(self):
+        entries = self.scan()
+        indexes = {field: {} for field in INDEXES}
+        for name, metadata in entries.items():
+            for field in INDEXES:
+                indexes[field].setdefault(metadata[field], {})[name] = metadata
+
+        # Write the new indexes, then drop index files for users who no longer
+        # have any entries
+        for field, by_user in indexes.items():
+            directory = os.path.join(self.root, INDEXES[field])
+            os.makedirs(directory, exist_ok=True)
+            keep = set()
+            for username, user_entries in by_user.items():
+                write_json_atomic(self._path(field, username), user_entries)
+                keep.add(user_key(username) + '.json')
+            for name in os.listdir(directory):
+                if name.endswith('.json') and name not in keep:
+                    os.remove(os.path.join(directory, name))
+        return len(entries)
+
+    def verify(self):
+        """Compare the catalog with the metadata files, returning a list of problems"""
+        on_disk = self.scan()
+        catalogued = self._catalogued()
+        problems = []
+        for name in sorted(set(on_disk) - set(catalogued)):
+            problems.append(f"missing from catalog: {name}")
+        for name in sorted(set(catalogued) - set(on_disk)):
+            problems.append(f"catalog entry without metadata file: {name}")
+        for name in sorted(set(on_disk) & set(catalogued)):
+            if on_disk[name] != catalogued[name]:
+                problems.append(f"catalog entry out of date: {name}")
+        for username, entries in self._sender_index().items():
+            for name, metadata in entries.items():
+                if on_disk.get(name, {}).get('sender') != username:
+                    problems.append(f"stale sender index entry for {username}: {name}")
+        return problems
+
+    def _sender_index(self):
+        """Read the sender index as username -> entries"""
+        by_sender = {}
+        directory = os.path.join(self.root, INDEXES['sender'])
+        if not os.path.isdir(directory):
+            return by_sender
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                username = bytes.fromhex(name[:-len('.json')]).decode('utf-8')
+                with open(os.path.join(directory, name), 'r') as f:
+                    by_sender[username] = json.load(f)
+        return by_sender
@@ -0,0 +1,88 @@
+import json
+
+from message_encryption import MessageEncryption
+
+# Messages decrypted and shown per inbox page
+PAGE_SIZE = 10
+
+
+def decode_message(encryption, record, attached=None):
+    """Decrypt a stored message into a dict with its text and analysis.
+
+    attached is an encrypted analysis stored after the message was sent;
+    its fields replace the ones sent with the message.
+    """
+    message = {
+        'seq': record['seq'],
+        'timestamp': record['timestamp'],
+        'message': None,
+        'analysis': None,
+        'binary': False,
+        'error': None
+    }
+    try:
+        decrypted_message = encryption.decrypt_message(record['message'])
+    except Exception as e:
+        message['error'] = str(e)
+        return message
+
+    # Handle both string and binary data
+    if not isinstance(decrypted_message, str):
+        message['binary'] = True
+        return message
+    try:
+        message_data = json.loads(decrypted_message)
+        message['message'] = message_data['message']
+        message['analysis'] = message_data.get('analysis')
+    except (json.JSONDecodeError, TypeError, KeyError):
+        message['message'] = decrypted_message
+    if attached is not None:
+        try:
+            analysis = json.loads(encryption.decrypt_message(attached))
+            message['analysis'] = dict(message['analysis'] or {}, **analysis)
+        except (ValueError, TypeError):
+            # The message itself is still readable without it
+            pass
+    return message
+
+
+class Inbox:
+    def __init__(self, storage, username, page_size=PAGE_SIZE):
+        self.storage = storage
+        self.username = username
+        self.page_size = page_size
+        # One derived key per sender, reused for every page
+        self.ciphers = {}
+
+    def senders(self):
+        """List the users who have sent this user messages"""
+        return self.storage.inbox_senders(self.username)
+
+    def use_key(self, sender, key):
+        """Keep an already derived shared key for a sender's messages"""
+        encryption = MessageEncryption()
+        encryption.set_key(key)
+        self.ciphers[sender] = encryption
+
+    def page(self, sender, cursor=None):
+        """Decrypt one page of a sender's messages newest first, returning (messages, next cursor)"""
+        # The next cursor is None once the oldest message has been read
+        records = self.storage.inbox_page(self.username, sender, before=cursor,
+                                          limit=self.page_size + 1)
+        has_more = len(records) > self.page_size
+        records = records[:self.page_size]
+        encryption = self.ciphers[sender]
+        attached = self.storage.message_analyses(record['seq'] for record in records)
+        messages = [decode_message(encryption, record, attached.get(record['seq']))
+                    for record in records]
+        next_cursor = records[-1]['seq'] if has_more else None
+        return messages, next_cursor
+
+    def pages(self, sender, cursor=None):
+        """Yield decrypted pages of a sender's messages, newest first"""
+        while True:
+            messages, cursor = self.page(sender, cursor)
+            if messages:
+                yield messages
+            if cursor is None:
+                return
@@ -1,23 +1,40 @@
 from auth import UserAuth
-from message_encryption import MessageEncryption
+from message_encryption import MessageEncryption, derive_key
 from message_ml import MessageAnalyzer
+from analysis_pipeline import open_pipeline
+from storage import open_storage
+from inbox import Inbox
 import os
 import json
+import atexit
 from datetime import datetime
 
 def main():
     # Initialize systems
-    auth = UserAuth()
-    encryption = MessageEncryption()
+    storage = open_storage()
+    auth = UserAuth(storage)
+    encryption = MessageEncryption(compression='zlib')
     analyzer = MessageAnalyzer()
+    # Classifies sent messages in the background in async analysis mode
+    pipeline = open_pipeline(analyzer, storage)
+    # Flush on every exit, including end of input and Ctrl-C, not just option 8
+    atexit.register(shut_down, pipeline, analyzer, auth, storage)
     current_user = None
     current_password = None
+    session_token = None
     
     # Create shared files directory if it doesn't exist
     shared_dir = "shared_files"
     if not os.path.exists(shared_dir):
         os.makedirs(shared_dir)
     
+    # One-time import of the legacy JSON history into the message store
+    history_file = "message_history.json"
+    if not storage.has_messages() and os.path.exists(history_file):
+        imported = storage.import_json_history(history_file)
+        if imported:
+            print(f"Imported {imported} messages from {history_file}")
+    
     while True:
         print("\n=== Secure Messaging System ===")
         print("1. Register")
@@ -27,9 +44,10 @@ def main():
         print("5. View Received Messages")
         print("6. View Received Files")
         print("7. View Message Statistics")
-        print("8. Exit")
+        print("8. View Sent Files")
+        print("9. Exit")
         
-        choice = input("Enter your choice (1-8): ")
+        choice = input("Enter your choice (1-9): ")
         
         if choice == "1":
             username = input("Enter username: ")
@@ -38,44 +56,62 @@ def main():
             print(message)
             
         elif choice == "2":
+            # Load the classifier in the background while the user types and
+            # the password is checked
+            analyzer.warm_up()
             username = input("Enter username: ")
             password = input("Enter password: ")
-            success, message = auth.verify_user(username, password)
+            success, message, token = auth.login(username, password)
             print(message)
             if success:
+                if session_token:
+                    auth.logout(session_token)
                 current_user = username
                 current_password = password
+                session_token = token
                 
         elif choice == "3":
-            if not current_user:
+            if not current_user or not auth.validate_session(session_token):
                 print("Please login first!")
                 continue
                 
             receiver = input("Enter receiver's username: ")
-            if not auth.validate_session(receiver):
+            if not auth.user_exists(receiver):
                 print("Receiver not found!")
                 continue
                 
-            # Get receiver's password for shared key
-            receiver_password = input("Enter receiver's password for message sharing: ")
-            if not auth.verify_user(receiver, receiver_password)[0]:
-                print("Invalid receiver password!")
-                continue
+            # Get receiver's password for shared key, unless this session
+            # already verified it
+            shared_key = auth.sessions.get_key(session_token, current_user, receiver)
+            if shared_key is None:
+                receiver_password = input("Enter receiver's password for message sharing: ")
+                if not auth.verify_user(receiver, receiver_password)[0]:
+                    print("Invalid receiver password!")
+                    continue
+                shared_key = derive_key(current_password + receiver_password)
+                auth.sessions.put_key(session_token, current_user, receiver, shared_key)
                 
             message = input("Enter your message: ")
             
-            # Analyze message using ML
-            analysis = analyzer.analyze_message(message)
-            if analyzer.is_suspicious(message):
+            # Analyze message using ML; in async mode only the pattern check
+            # runs now and the classifier's result is attached once ready
+            if pipeline:
+                analysis = pipeline.check(message)
+            else:
+                analysis = analyzer.analyze_message(message)
+            if analyzer.is_suspicious(message, analysis):
                 print("\nWarning: Message contains suspicious content!")
                 print(f"Suspicious score: {analysis['suspicious_score']}")
+                categories = analyzer.suspicious_categories(message)
+                flagged = [f"{category} ({count})" for category, count in categories.items() if count]
+                if flagged:
+                    print(f"Matched: {', '.join(flagged)}")
                 proceed = input("Do you want to send this message anyway? (y/n): ")
                 if proceed.lower() != 'y':
                     continue
             
-            # Generate shared key using both passwords
-            shared_key = current_password + receiver_password
-            encryption.generate_key(shared_key)
+            # Encrypt with the shared key derived from both passwords
+            encryption.set_key(shared_key)
             
             # Create message object with metadata
             message_data = {
@@ -91,29 +127,34 @@ def main():
             encrypted_message = encryption.encrypt_message(message_str)
             
             # Save message to history
-            save_message_history(current_user, receiver, encrypted_message)
+            seq = save_message_history(current_user, receiver, encrypted_message, storage)
+            if pipeline:
+                pipeline.submit(seq, message, shared_key)
             
             print("\nMessage sent successfully!")
             print("Message Analysis:")
-            print(f"Type: {analysis['type']}")
-            print(f"Confidence: {analysis['confidence']:.2f}")
-            print(f"Suspicious Score: {analysis['suspicious_score']}")
+            print_analysis(analysis, "")
             
         elif choice == "4":
-            if not current_user:
+            if not current_user or not auth.validate_session(session_token):
                 print("Please login first!")
                 continue
                 
             receiver = input("Enter receiver's username: ")
-            if not auth.validate_session(receiver):
+            if not auth.user_exists(receiver):
                 print("Receiver not found!")
                 continue
                 
-            # Get receiver's password for shared key
-            receiver_password = input("Enter receiver's password for file sharing: ")
-            if not auth.verify_user(receiver, receiver_password)[0]:
-                print("Invalid receiver password!")
-                continue
+            # Get receiver's password for shared key, unless this session
+            # already verified it
+            shared_key = auth.sessions.get_key(session_token, current_user, receiver)
+            if shared_key is None:
+                receiver_password = input("Enter receiver's password for file sharing: ")
+                if not auth.verify_user(receiver, receiver_password)[0]:
+                    print("Invalid receiver password!")
+                    continue
+                shared_key = derive_key(current_password + receiver_password)
+                auth.sessions.put_key(session_token, current_user, receiver, shared_key)
                 
             file_path = input("Enter full file path to send: ")
             
@@ -128,9 +169,8 @@ def main():
             shared_filename = f"{current_user}_{receiver}_{timestamp}_{original_filename}"
             shared_path = os.path.join(shared_dir, shared_filename)
                 
-            # Generate shared key using both passwords
-            shared_key = current_password + receiver_password
-            encryption.generate_key(shared_key)
+            # Encrypt with the shared key derived from both passwords
+            encryption.set_key(shared_key)
             
             # Create file metadata
             file_data = {
@@ -141,183 +181,177 @@ def main():
                 "timestamp": datetime.now().isoformat()
             }
             
-            # Save metadata
-            metadata_path = os.path.join(shared_dir, shared_filename + '.metadata')
-            with open(metadata_path, 'w') as f:
-                json.dump(file_data, f)
-            
             try:
-                # Copy and encrypt the file to shared directory
-                with open(file_path, 'rb') as src, open(shared_path + '.encrypted', 'wb') as dst:
-                    file_data = src.read()
-                    encrypted_data = encryption.encrypt_message(file_data)
-                    dst.write(encrypted_data)
+                # Encrypt the file into the shared directory, then move the
+                # ciphertext into the blob store, which keeps identical files once
+                encrypted_path = shared_path + '.encrypted'
+                encryption.encrypt_file_to(file_path, encrypted_path)
+                
+                # Save metadata
+                storage.add_shared_file(file_data, encrypted_path)
                 print(f"\nFile sent successfully!")
             except Exception as e:
                 print(f"Error sending file: {str(e)}")
                 continue
             
         elif choice == "5":
-            if not current_user:
+            if not current_user or not auth.validate_session(session_token):
                 print("Please login first!")
                 continue
                 
             print("\nReceived Messages:")
-            view_received_messages(current_user, current_password)
+            view_received_messages(current_user, current_password, storage, auth, session_token)
             
         elif choice == "6":
-            if not current_user:
+            if not current_user or not auth.validate_session(session_token):
                 print("Please login first!")
                 continue
                 
             print("\nReceived Files:")
-            view_received_files(current_user, current_password)
+            view_received_files(current_user, current_password, storage, auth, session_token)
             
         elif choice == "7":
-            if not current_user:
+            if not current_user or not auth.validate_session(session_token):
                 print("Please login first!")
                 continue
                 
             print("\nMessage Statistics:")
             stats = analyzer.get_message_stats()
             print(f"Total Messages: {stats['total_messages']}")
-            print(f"Average Message Length: {stats['average_length']:.2f} characters")
+            print(f"Average Message Length: {stats['average_length']:.2f} characters "
+                  f"(std. dev. {stats['length_stddev']:.2f})")
+            print(f"Messages in the Last Hour: {stats['recent']['last_hour']}")
+            print(f"Messages in the Last Day: {stats['recent']['last_day']}")
             print("\nTop 10 Most Common Words:")
             for word, count in stats['top_words'].items():
                 print(f"{word}: {count}")
             
+            session_stats = auth.session_stats()
+            print("\nSession Cache:")
+            print(f"Live Sessions: {session_stats['live_sessions']}")
+            print(f"Session Hit Rate: {session_stats['hit_rate']:.2%}")
+            print(f"Key Cache Hit Rate: {session_stats['key_hit_rate']:.2%}")
+            print(f"Evictions: {session_stats['evictions']}")
+            
+            cache_stats = analyzer.cache_stats()
+            print("\nAnalysis Cache:")
+            print(f"Cached Results: {cache_stats['size']}")
+            print(f"Hits: {cache_stats['hits']}, Misses: {cache_stats['misses']}")
+            print(f"Hit Rate: {cache_stats['hit_rate']:.2%}")
+            
+            if pipeline:
+                pipeline_stats = pipeline.stats()
+                print("\nBackground Analysis:")
+                print(f"Queued: {pipeline_stats['queued']}/{pipeline_stats['capacity']}, "
+                      f"Completed: {pipeline_stats['completed']}, Failed: {pipeline_stats['failed']}")
+                print(f"Senders Held Back by a Full Queue: {pipeline_stats['blocked']}")
+                for stage, latency in pipeline_stats['latency'].items():
+                    print(f"{stage}: p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms "
+                          f"({latency['count']} samples)")
+            
         elif choice == "8":
+            if not current_user or not auth.validate_session(session_token):
+                print("Please login first!")
+                continue
+                
+            print("\nSent Files:")
+            view_sent_files(current_user, storage)
+            
+        elif choice == "9":
             print("Goodbye!")
             break
             
         else:
             print("Invalid choice! Please try again.")
 
-def save_message_history(sender, receiver, encrypted_message):
-    """Save message to history file"""
-    history_file = "message_history.json"
-    history = {}
-    
-    if os.path.exists(history_file):
-        with open(history_file, 'r') as f:
-            history = json.load(f)
-    
-    if sender not in history:
-        history[sender] = []
-    if receiver not in history:
-        history[receiver] = []
-        
-    history[sender].append({
-        "type": "sent",
-        "to": receiver,
-        "message": encrypted_message.decode(),
-        "timestamp": datetime.now().isoformat()
-    })
-    
-    history[receiver].append({
-        "type": "received",
-        "from": sender,
-        "message": encrypted_message.decode(),
-        "timestamp": datetime.now().isoformat()
-    })
-    
-    with open(history_file, 'w') as f:
-        json.dump(history, f)
+def shut_down(pipeline, analyzer, auth, storage):
+    """Finish queued analyses and write pending logins, statistics and messages"""
+    if pipeline:
+        pipeline.close()
+    analyzer.close()
+    auth.close()
+    storage.close()
 
-def view_received_messages(username, password):
-    """View and decrypt received messages"""
-    history_file = "message_history.json"
-    if not os.path.exists(history_file):
-        print("No messages found.")
-        return
-        
-    with open(history_file, 'r') as f:
-        history = json.load(f)
-        
-    if username not in history:
-        print("No messages found.")
-        return
-    
-    received_messages = [msg for msg in history[username] if msg['type'] == 'received']
+def save_message_history(sender, receiver, encrypted_message, storage):
+    """Store a message in the message history, returning its sequence number"""
+    # One record serves both the sender's and the receiver's history
+    return storage.append_message(sender, receiver, encrypted_message, datetime.now().isoformat())
+
+def print_analysis(analysis, indent):
+    """Print a message's analysis; the classifier's fields may still be pending"""
+    if 'type' in analysis:
+        print(f"{indent}Type: {analysis['type']}")
+        print(f"{indent}Confidence: {analysis['confidence']:.2f}")
+    else:
+        print(f"{indent}Type: pending")
+    print(f"{indent}Suspicious Score: {analysis['suspicious_score']}")
+
+def sender_key(auth, token, sender, username, password, prompt):
+    """Shared key for a sender's messages or files, asking for their password if the session has none"""
+    key = auth.sessions.get_key(token, sender, username)
+    if key is not None:
+        return key
+    sender_password = input(prompt)
+    key = derive_key(sender_password + password)
+    # Only a verified password is remembered; a wrong one just fails to decrypt
+    if auth.check_password(sender, sender_password):
+        auth.sessions.put_key(token, sender, username, key)
+    return key
+
+def view_received_messages(username, password, storage, auth, token):
+    """View and decrypt received messages, one page at a time"""
+    inbox = Inbox(storage, username)
+    senders = inbox.senders()
     
-    if not received_messages:
+    if not senders:
         print("No received messages found.")
         return
     
-    # Group messages by sender
-    messages_by_sender = {}
-    for msg in received_messages:
-        sender = msg['from']
-        if sender not in messages_by_sender:
-            messages_by_sender[sender] = []
-        messages_by_sender[sender].append(msg)
-    
     print(f"\nReceived messages:")
     
-    for sender, messages in messages_by_sender.items():
+    for sender in senders:
         print(f"\nFrom: {sender}")
-        try:
-            # Get sender's password once for all messages from this sender
-            sender_password = input(f"Enter {sender}'s password to decrypt messages: ")
-            
-            # Initialize encryption with shared key
-            encryption = MessageEncryption()
-            shared_key = sender_password + password
-            encryption.generate_key(shared_key)
-            
-            # Decrypt all messages from this sender
-            for i, msg in enumerate(messages, 1):
+        # Get sender's password once for all messages from this sender
+        inbox.use_key(sender, sender_key(auth, token, sender, username, password,
+                                         f"Enter {sender}'s password to decrypt messages: "))
+        
+        # Cursors of the pages shown so far, so the user can page back
+        cursors = [None]
+        while True:
+            messages, next_cursor = inbox.page(sender, cursors[-1])
+            first_number = (len(cursors) - 1) * inbox.page_size + 1
+            for i, msg in enumerate(messages, first_number):
                 print(f"\n{i}. Time: {msg['timestamp']}")
-                try:
-                    # Decrypt the message
-                    decrypted_message = encryption.decrypt_message(msg['message'].encode())
-                    
-                    # Handle both string and binary data
-                    if isinstance(decrypted_message, str):
-                        try:
-                            message_data = json.loads(decrypted_message)
-                            print(f"   Message: {message_data['message']}")
-                            if 'analysis' in message_data:
-                                analysis = message_data['analysis']
-                                print(f"   Type: {analysis['type']}")
-                                print(f"   Confidence: {analysis['confidence']:.2f}")
-                                print(f"   Suspicious Score: {analysis['suspicious_score']}")
-                        except json.JSONDecodeError:
-                            print(f"   Message: {decrypted_message}")
-                    else:
-                        print(f"   Message: [Binary data]")
-                except Exception as e:
+                if msg['error']:
                     print(f"   Status: Could not decrypt message {i}")
-                    print(f"   Error: {str(e)}")
-                    
-        except Exception as e:
-            print(f"   Status: Could not decrypt messages from {sender}")
-            print(f"   Error: {str(e)}")
+                    print(f"   Error: {msg['error']}")
+                elif msg['binary']:
+                    print(f"   Message: [Binary data]")
+                else:
+                    print(f"   Message: {msg['message']}")
+                    analysis = msg['analysis']
+                    if analysis:
+                        print_analysis(analysis, "   ")
+            
+            options = []
+            if next_cursor is not None:
+                options.append("n: older")
+            if len(cursors) > 1:
+                options.append("p: newer")
+            if not options:
+                break
+            action = input(f"\nPage {len(cursors)} ({', '.join(options)}, any other key: done): ").lower()
+            if action == 'n' and next_cursor is not None:
+                cursors.append(next_cursor)
+            elif action == 'p' and len(cursors) > 1:
+                cursors.pop()
+            else:
+                break
 
-def view_received_files(username, password):
+def view_received_files(username, password, storage, auth, token):
     """View and decrypt received files"""
     shared_dir = "shared_files"
-    if not os.path.exists(shared_dir):
-        print("No received files found.")
-        return
-        
-    # Look for .metadata files in shared directory
-    metadata_files = [f for f in os.listdir(shared_dir) if f.endswith('.metadata')]
-    
-    if not metadata_files:
-        print("No received files found.")
-        return
-    
-    # Filter metadata files for this user
-    user_files = []
-    for metadata_file in metadata_files:
-        try:
-            with open(os.path.join(shared_dir, metadata_file), 'r') as f:
-                metadata = json.load(f)
-                if metadata.get('receiver') == username:
-                    user_files.append((metadata_file, metadata))
-        except Exception as e:
-            continue
+    user_files = storage.received_files(username)
     
     if not user_files:
         print("No received files found.")
@@ -325,41 +359,49 @@ def view_received_files(username, password):
     
     print(f"\nReceived files:")
     
-    for i, (metadata_file, metadata) in enumerate(user_files, 1):
+    for i, metadata in enumerate(user_files, 1):
         print(f"\n{i}. From: {metadata['sender']}")
         print(f"   File: {metadata['filename']}")
         
         # Get the corresponding encrypted file
-        encrypted_file = os.path.join(shared_dir, metadata_file.replace('.metadata', '.encrypted'))
+        encrypted_file = metadata['encrypted_path']
         if not os.path.exists(encrypted_file):
             continue
         
         try:
             # Get sender's password for shared key
-            sender_password = input(f"Enter {metadata['sender']}'s password to decrypt: ")
+            shared_key = sender_key(auth, token, metadata['sender'], username, password,
+                                    f"Enter {metadata['sender']}'s password to decrypt: ")
             
             # Initialize encryption with shared key
             encryption = MessageEncryption()
-            shared_key = sender_password + password
-            encryption.generate_key(shared_key)
+            encryption.set_key(shared_key)
             
-            # Decrypt the file
-            with open(encrypted_file, 'rb') as f:
-                encrypted_data = f.read()
-            decrypted_data = encryption.decrypt_message(encrypted_data)
-            
-            # Save decrypted file
+            # Decrypt the file straight into the saved copy
             decrypted_path = os.path.join(shared_dir, f"decrypted_{metadata['filename']}")
-            with open(decrypted_path, 'wb') as f:
-                if isinstance(decrypted_data, str):
-                    f.write(decrypted_data.encode())
-                else:
-                    f.write(decrypted_data)
+            encryption.decrypt_file_to(encrypted_file, decrypted_path)
             print(f"   Status: Decrypted successfully")
             print(f"   Saved as: {decrypted_path}")
         except Exception as e:
             print(f"   Status: Could not decrypt")
             print(f"   Error: {str(e)}")
 
+def view_sent_files(username, storage):
+    """List the files a user has shared"""
+    sent_files = storage.sent_files(username)
+    
+    if not sent_files:
+        print("No sent files found.")
+        return
+    
+    for i, metadata in enumerate(sent_files, 1):
+        print(f"\n{i}. To: {metadata['receiver']}")
+        print(f"   File: {metadata['filename']}")
+        print(f"   Sent: {metadata['timestamp']}")
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    try:
+        main()
+    except (KeyboardInterrupt, EOFError):
+        # Pending writes are flushed by shut_down at exit
+        print("\nGoodbye!")
\ No newline at end of file
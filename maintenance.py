@@ -0,0 +1,58 @@
+import argparse
+import sys
+
+from storage import open_storage
+
+
+def gc_blobs(storage, args):
+    """Delete blobs no message or file refers to"""
+    deleted = storage.collect_garbage()
+    print(f"Deleted {deleted} orphaned blobs")
+
+
+def rebuild_catalog(storage, args):
+    """Rebuild the shared-files catalog from the files on disk"""
+    indexed = storage.rebuild_file_catalog()
+    print(f"Indexed {indexed} shared files")
+
+
+def verify_catalog(storage, args):
+    """Report differences between the shared-files catalog and the files on disk"""
+    problems = storage.verify_file_catalog()
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{len(problems)} problems found; run rebuild-catalog to repair the index")
+        return 1
+    print("Catalog is consistent")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Secure Messenger storage maintenance")
+    parser.add_argument('--storage', choices=['json', 'sqlite'],
+                        help="Storage backend (default: SECURE_MESSENGER_STORAGE or json)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gc_parser = subparsers.add_parser('gc-blobs', help="Garbage-collect orphaned blobs")
+    gc_parser.set_defaults(func=gc_blobs)
+
+    rebuild_parser = subparsers.add_parser('rebuild-catalog',
+                                           help="Rebuild the shared-files catalog")
+    rebuild_parser.set_defaults(func=rebuild_catalog)
+
+    verify_parser = subparsers.add_parser('verify-catalog',
+                                          help="Check the shared-files catalog against the directory")
+    verify_parser.set_defaults(func=verify_catalog)
+
+    args = parser.parse_args()
+    storage = open_storage(args.storage)
+    try:
+        status = args.func(storage, args)
+    finally:
+        storage.close()
+    return status or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
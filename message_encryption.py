@@ -1,19 +1,295 @@
 import hashlib
 import base64
+import lzma
 import os
-from itertools import cycle
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import mmap
+except ImportError:  # buffered streaming is used instead
+    mmap = None
+
+# NumPy is imported by xor_into on first use, so importing this module (and
+# starting main.py) stays cheap; False once it is known to be missing
+np = None
+
+# Bytes XORed per block by the bulk cipher core
+XOR_BLOCK_SIZE = 1 << 20
+
+# Plaintext bytes per chunk when streaming files; legacy base64 files are
+# read in whole encoded groups, so this must be a multiple of 3
+STREAM_CHUNK_SIZE = 3 << 20
+
+# Files at least this large are encrypted between memory mappings
+MMAP_THRESHOLD = 64 << 20
+
+# Files at least this large are split into ranges encrypted on a process pool
+PARALLEL_THRESHOLD = 256 << 20
+
+# Plaintext bytes handed to a worker per range
+PARALLEL_RANGE_SIZE = 8 * STREAM_CHUNK_SIZE
+
+# Binary ciphertext envelope: magic, version, flags, header size,
+# payload size and plaintext size, followed by the raw ciphertext
+ENVELOPE_MAGIC = b'SMSG'
+ENVELOPE_VERSION = 1
+ENVELOPE_HEADER = struct.Struct('>4sBBHQQ')
+
+# Envelope flags recording which codec compressed the plaintext
+FLAG_ZLIB = 0x01
+FLAG_LZMA = 0x02
+COMPRESSION_FLAGS = {'zlib': FLAG_ZLIB, 'lzma': FLAG_LZMA}
+COMPRESSION_MASK = FLAG_ZLIB | FLAG_LZMA
+
+# Payloads smaller than this are stored uncompressed
+MIN_COMPRESS_SIZE = 256
+
+# Compression is kept only when it shrinks the payload below this ratio
+MAX_COMPRESS_RATIO = 0.9
+
+# Leading bytes of a file compressed to decide whether it is worth compressing
+COMPRESS_PROBE_SIZE = 64 << 10
+
+
+def derive_key(password):
+    """Derive the 32-byte encryption key for a password"""
+    # Create a strong key using SHA-256
+    return hashlib.sha256(password.encode()).digest()
+
+
+def xor_into(dst, src, key, offset=0):
+    """XOR src with the repeating key into dst, starting at keystream position offset"""
+    length = len(src)
+    if len(dst) != length:
+        raise ValueError("Source and destination buffers must be the same size")
+    if not length:
+        return
+
+    # Rotate the key so the tiled block starts at the right keystream byte, and
+    # keep blocks a whole number of keys long so every block reuses the same tile
+    shift = offset % len(key)
+    key = key[shift:] + key[:shift]
+    block_size = max(XOR_BLOCK_SIZE // len(key), 1) * len(key)
+    tile = key * (min(block_size, length) // len(key) + 1)
+
+    global np
+    if np is None:
+        try:
+            import numpy as np
+        except ImportError:  # the pure-Python wide-integer core is used instead
+            np = False
+
+    if np:
+        src_array = np.frombuffer(src, dtype=np.uint8)
+        dst_array = np.frombuffer(dst, dtype=np.uint8)
+        tile_array = np.frombuffer(tile, dtype=np.uint8)
+        for start in range(0, length, block_size):
+            end = min(start + block_size, length)
+            np.bitwise_xor(src_array[start:end], tile_array[:end - start], out=dst_array[start:end])
+        return
+
+    src = memoryview(src)
+    for start in range(0, length, block_size):
+        end = min(start + block_size, length)
+        size = end - start
+        block = int.from_bytes(src[start:end], 'little') ^ int.from_bytes(tile[:size], 'little')
+        dst[start:end] = block.to_bytes(size, 'little')
+
+
+def read_exact(stream, size):
+    """Read up to size bytes, only returning fewer at end of stream"""
+    data = stream.read(size)
+    if not data or len(data) == size:
+        return data
+    
+    chunks = [data]
+    remaining = size - len(data)
+    while remaining:
+        data = stream.read(remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    return b''.join(chunks)
+
+
+def map_file(file, length=0, writable=False):
+    """Memory-map an open file, returning None when mmap is unavailable"""
+    if mmap is None:
+        return None
+    access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+    try:
+        return mmap.mmap(file.fileno(), length, access=access)
+    except (ValueError, OSError):
+        # Empty files and unsupported file systems cannot be mapped
+        return None
+
+
+def xor_keystream(data, key, offset=0):
+    """Return data XORed with the repeating key, starting at keystream position offset"""
+    output = bytearray(len(data))
+    xor_into(output, data, key, offset)
+    return bytes(output)
+
+
+def pack_header(payload_size, plain_size=None, flags=0):
+    """Build the envelope header for a payload"""
+    if plain_size is None:
+        plain_size = payload_size
+    return ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION, flags,
+                                ENVELOPE_HEADER.size, payload_size, plain_size)
+
+
+def unpack_header(data):
+    """Parse an envelope header, returning None for legacy base64 data"""
+    if len(data) < ENVELOPE_HEADER.size:
+        return None
+    magic, version, flags, header_size, payload_size, plain_size = \
+        ENVELOPE_HEADER.unpack_from(data)
+    # Legacy base64 can start with the magic too, but never with a binary
+    # version byte, so both are checked before trusting the header
+    if magic != ENVELOPE_MAGIC or not 0 < version < 0x2b:
+        return None
+    if version > ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported ciphertext envelope version {version}")
+    if header_size < ENVELOPE_HEADER.size:
+        raise ValueError("Corrupt ciphertext envelope header")
+    return {
+        'flags': flags,
+        'header_size': header_size,
+        'payload_size': payload_size,
+        'plain_size': plain_size
+    }
+
+
+def read_header(path):
+    """Read the envelope header of an encrypted file, or None for legacy files"""
+    with open(path, 'rb') as file:
+        return unpack_header(file.read(ENVELOPE_HEADER.size))
+
+
+def encrypt_range(key, source_path, destination_path, start, end, header_size):
+    """Encrypt plaintext bytes [start, end) of a file into their slot in the output"""
+    # The keystream byte at any offset is key[offset % len(key)], so every
+    # range can be encrypted without knowing anything about the others
+    with open(source_path, 'rb') as source, open(destination_path, 'r+b') as destination:
+        source.seek(start)
+        destination.seek(header_size + start)
+        offset = start
+        while offset < end:
+            chunk = read_exact(source, min(STREAM_CHUNK_SIZE, end - offset))
+            if not chunk:
+                break
+            destination.write(xor_keystream(chunk, key, offset))
+            offset += len(chunk)
+    return offset - start
+
+
+def decrypt_range(key, source_path, destination_path, start, end, header_size):
+    """Decrypt plaintext bytes [start, end) of a file into their slot in the output"""
+    with open(source_path, 'rb') as source, open(destination_path, 'r+b') as destination:
+        source.seek(header_size + start)
+        destination.seek(start)
+        offset = start
+        while offset < end:
+            chunk = read_exact(source, min(STREAM_CHUNK_SIZE, end - offset))
+            if not chunk:
+                break
+            destination.write(xor_keystream(chunk, key, offset))
+            offset += len(chunk)
+    return offset - start
+
+
+def compressor(codec, level=None):
+    """Create an incremental compressor for a codec name"""
+    if codec == 'zlib':
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+    if codec == 'lzma':
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError(f"Unknown compression codec: {codec}")
+
+
+def decompressor(flags):
+    """Create an incremental decompressor for an envelope's flags, or None"""
+    compression = flags & COMPRESSION_MASK
+    if not compression:
+        return None
+    if compression == FLAG_ZLIB:
+        return zlib.decompressobj()
+    if compression == FLAG_LZMA:
+        return lzma.LZMADecompressor()
+    raise ValueError("Corrupt ciphertext envelope flags")
+
+
+def decompress_chunks(engine, data, max_length):
+    """Decompress data incrementally, yielding at most max_length bytes at a time"""
+    if isinstance(engine, lzma.LZMADecompressor):
+        # Input the engine could not use yet is buffered inside it
+        while True:
+            decompressed = engine.decompress(data, max_length)
+            data = b''
+            if decompressed:
+                yield decompressed
+            if engine.needs_input or engine.eof:
+                return
+    else:
+        # A full output buffer may leave input in unconsumed_tail or output
+        # pending inside zlib, so keep going until a call returns less
+        while True:
+            decompressed = engine.decompress(data, max_length)
+            data = engine.unconsumed_tail
+            if decompressed:
+                yield decompressed
+            if not data and len(decompressed) < max_length:
+                return
+
+
+def compress(data, codec, level=None):
+    """Compress data in one call"""
+    engine = compressor(codec, level)
+    return engine.compress(data) + engine.flush()
+
+
+def stream_size(stream):
+    """Number of bytes left to read from a seekable stream"""
+    position = stream.tell()
+    end = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return end - position
+
 
 class MessageEncryption:
-    def __init__(self):
+    def __init__(self, workers=None, parallel_threshold=PARALLEL_THRESHOLD,
+                 compression=None, compression_level=None):
         self.key = None
+        # Worker processes for large files; None uses every CPU, 1 disables it
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        # Codec ('zlib' or 'lzma') applied before encryption; None disables it
+        if compression is not None and compression not in COMPRESSION_FLAGS:
+            raise ValueError(f"Unknown compression codec: {compression}")
+        self.compression = compression
+        self.compression_level = compression_level
+
+    def _worth_compressing(self, sample):
+        """Check whether compressing a payload (or a sample of it) pays off"""
+        if not self.compression or len(sample) < MIN_COMPRESS_SIZE:
+            return False
+        compressed = compress(sample, self.compression, self.compression_level)
+        return len(compressed) < len(sample) * MAX_COMPRESS_RATIO
 
     def generate_key(self, password):
         """Generate encryption key from password"""
-        # Create a strong key using SHA-256
-        self.key = hashlib.sha256(password.encode()).digest()
+        self.key = derive_key(password)
+
+    def set_key(self, key):
+        """Use a key derived earlier with derive_key"""
+        self.key = key
 
     def encrypt_message(self, message):
-        """Encrypt a message using XOR with the key"""
+        """Encrypt a message into a binary envelope using XOR with the key"""
         if not self.key:
             raise ValueError("Key not generated. Call generate_key first.")
         
@@ -21,22 +297,56 @@ class MessageEncryption:
         if isinstance(message, str):
             message = message.encode('utf-8')
         
-        # XOR the message with the key
-        encrypted = bytes(a ^ b for a, b in zip(message, cycle(self.key)))
+        # Compress first when it helps; ciphertext does not compress. Large
+        # payloads are probed first, so incompressible data is not compressed
+        # whole only to be thrown away.
+        plain_size = len(message)
+        flags = 0
+        if self.compression and plain_size >= MIN_COMPRESS_SIZE and (
+                plain_size <= COMPRESS_PROBE_SIZE or
+                self._worth_compressing(message[:COMPRESS_PROBE_SIZE])):
+            compressed = compress(message, self.compression, self.compression_level)
+            if len(compressed) < plain_size * MAX_COMPRESS_RATIO:
+                message = compressed
+                flags = COMPRESSION_FLAGS[self.compression]
         
-        # Convert to base64 for safe transmission
-        return base64.b64encode(encrypted)
+        # XOR the message with the key, behind the envelope header
+        header = pack_header(len(message), plain_size, flags)
+        encrypted = bytearray(len(header) + len(message))
+        encrypted[:len(header)] = header
+        xor_into(memoryview(encrypted)[len(header):], message, self.key)
+        
+        return bytes(encrypted)
 
     def decrypt_message(self, encrypted_message):
-        """Decrypt a message"""
+        """Decrypt a binary envelope or a legacy base64 message"""
         if not self.key:
             raise ValueError("Key not generated. Call generate_key first.")
         
-        # Decode from base64
-        encrypted = base64.b64decode(encrypted_message)
+        if isinstance(encrypted_message, str):
+            encrypted_message = encrypted_message.encode('ascii')
+        
+        # Envelopes stored in JSON are base64-wrapped; legacy messages are
+        # base64 of the bare ciphertext
+        header = unpack_header(encrypted_message)
+        if header is None:
+            encrypted_message = base64.b64decode(encrypted_message)
+            header = unpack_header(encrypted_message)
         
-        # XOR with the key to decrypt
-        decrypted = bytes(a ^ b for a, b in zip(encrypted, cycle(self.key)))
+        if header is None:
+            decrypted = xor_keystream(encrypted_message, self.key)
+        else:
+            start = header['header_size']
+            end = start + header['payload_size']
+            if len(encrypted_message) < end:
+                raise ValueError("Truncated ciphertext envelope")
+            decrypted = xor_keystream(memoryview(encrypted_message)[start:end], self.key)
+            engine = decompressor(header['flags'])
+            if engine is not None:
+                # Never inflate past the size the header declares
+                decrypted = engine.decompress(decrypted, header['plain_size'] + 1)
+            if len(decrypted) != header['plain_size']:
+                raise ValueError("Decrypted size does not match the envelope header")
         
         # Try to decode as UTF-8, return bytes if it fails
         try:
@@ -44,20 +354,258 @@ class MessageEncryption:
         except UnicodeDecodeError:
             return decrypted
 
-    def encrypt_file(self, file_path):
-        """Encrypt a file"""
+    def encrypt_stream(self, source, destination, chunk_size=STREAM_CHUNK_SIZE):
+        """Encrypt a seekable binary stream chunk by chunk, returning the number of bytes read"""
+        if not self.key:
+            raise ValueError("Key not generated. Call generate_key first.")
+        if chunk_size <= 0:
+            raise ValueError("Chunk size must be positive")
+        
+        size = stream_size(source)
+        probe = read_exact(source, min(COMPRESS_PROBE_SIZE, size))
+        if self._worth_compressing(probe):
+            return self._encrypt_compressed_stream(probe, source, destination, size, chunk_size)
+        
+        destination.write(pack_header(size))
+        destination.write(xor_keystream(probe, self.key))
+        offset = len(probe)
+        while offset < size:
+            chunk = read_exact(source, min(chunk_size, size - offset))
+            if not chunk:
+                raise ValueError("Source stream ended early")
+            destination.write(xor_keystream(chunk, self.key, offset))
+            offset += len(chunk)
+        
+        return offset
+
+    def _encrypt_compressed_stream(self, probe, source, destination, size, chunk_size):
+        """Compress and encrypt a stream whose first bytes were already read"""
+        # The payload size is only known at the end, so the header is written
+        # as a placeholder and patched once the stream is done
+        header_position = destination.tell()
+        destination.write(pack_header(0, size))
+        engine = compressor(self.compression, self.compression_level)
+        offset = 0
+        chunk = probe
+        while chunk:
+            compressed = engine.compress(chunk)
+            destination.write(xor_keystream(compressed, self.key, offset))
+            offset += len(compressed)
+            chunk = read_exact(source, chunk_size)
+        compressed = engine.flush()
+        destination.write(xor_keystream(compressed, self.key, offset))
+        offset += len(compressed)
+        
+        end_position = destination.tell()
+        destination.seek(header_position)
+        destination.write(pack_header(offset, size, COMPRESSION_FLAGS[self.compression]))
+        destination.seek(end_position)
+        
+        return size
+
+    def decrypt_stream(self, source, destination, chunk_size=STREAM_CHUNK_SIZE):
+        """Decrypt a binary or legacy base64 stream chunk by chunk, returning the number of bytes written"""
+        if not self.key:
+            raise ValueError("Key not generated. Call generate_key first.")
+        if chunk_size <= 0 or chunk_size % 3:
+            raise ValueError("Chunk size must be a positive multiple of 3")
+        
+        prefix = read_exact(source, ENVELOPE_HEADER.size)
+        header = unpack_header(prefix)
+        if header is None:
+            return self._decrypt_legacy_stream(prefix, source, destination, chunk_size)
+        
+        source.seek(header['header_size'] - ENVELOPE_HEADER.size, os.SEEK_CUR)
+        engine = decompressor(header['flags'])
+        size = header['payload_size']
+        offset = 0
+        written = 0
+        while offset < size:
+            chunk = read_exact(source, min(chunk_size, size - offset))
+            if not chunk:
+                raise ValueError("Truncated ciphertext envelope")
+            decrypted = xor_keystream(chunk, self.key, offset)
+            offset += len(chunk)
+            if engine is None:
+                destination.write(decrypted)
+                written += len(decrypted)
+                continue
+            # Highly compressible chunks expand without bound, so output is
+            # written a chunk at a time
+            for decompressed in decompress_chunks(engine, decrypted, chunk_size):
+                destination.write(decompressed)
+                written += len(decompressed)
+                if written > header['plain_size']:
+                    raise ValueError("Decrypted size does not match the envelope header")
+        
+        if written != header['plain_size']:
+            raise ValueError("Decrypted size does not match the envelope header")
+        return written
+
+    def _decrypt_legacy_stream(self, prefix, source, destination, chunk_size):
+        """Decrypt a legacy base64 stream whose first bytes were already read"""
+        # Read whole base64 groups so no chunk splits an encoded quantum; the
+        # prefix is one header long, itself a whole number of groups
+        encoded_chunk_size = chunk_size // 3 * 4
+        chunk = prefix + read_exact(source, encoded_chunk_size - len(prefix))
+        offset = 0
+        while chunk:
+            decoded = base64.b64decode(chunk)
+            destination.write(xor_keystream(decoded, self.key, offset))
+            offset += len(decoded)
+            chunk = read_exact(source, encoded_chunk_size)
+        
+        return offset
+
+    def encrypt_file_mmap(self, source_path, destination_path):
+        """Encrypt a file between memory mappings, returning the number of bytes read"""
+        if not self.key:
+            raise ValueError("Key not generated. Call generate_key first.")
+        
+        with open(source_path, 'rb') as source, open(destination_path, 'w+b') as destination:
+            source_map = map_file(source)
+            if source_map is None:
+                return self.encrypt_stream(source, destination)
+            
+            with source_map, memoryview(source_map) as source_view:
+                size = len(source_view)
+                header = pack_header(size)
+                destination.truncate(len(header) + size)
+                destination_map = map_file(destination, writable=True)
+                if destination_map is None:
+                    destination.truncate(0)
+                    return self.encrypt_stream(source, destination)
+                
+                # Ciphertext is XORed straight from one mapping into the other
+                with destination_map, memoryview(destination_map) as destination_view:
+                    destination_view[:len(header)] = header
+                    xor_into(destination_view[len(header):], source_view, self.key)
+                    destination_map.flush()
+        
+        return size
+
+    def decrypt_file_mmap(self, source_path, destination_path):
+        """Decrypt a file between memory mappings, returning the number of bytes written"""
         if not self.key:
             raise ValueError("Key not generated. Call generate_key first.")
         
-        with open(file_path, 'rb') as file:
-            file_data = file.read()
+        header = read_header(source_path)
+        if header is None or header['flags'] & COMPRESSION_MASK:
+            # Legacy base64 and compressed files are decoded by the buffered stream path
+            with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+                return self.decrypt_stream(source, destination)
+        
+        with open(source_path, 'rb') as source, open(destination_path, 'w+b') as destination:
+            size = header['payload_size']
+            source_map = map_file(source)
+            if source_map is None or not size:
+                return self.decrypt_stream(source, destination)
+            
+            with source_map, memoryview(source_map) as source_view:
+                start = header['header_size']
+                if len(source_view) < start + size:
+                    raise ValueError("Truncated ciphertext envelope")
+                destination.truncate(size)
+                destination_map = map_file(destination, writable=True)
+                if destination_map is None:
+                    destination.truncate(0)
+                    return self.decrypt_stream(source, destination)
+                
+                # Plaintext is XORed directly into the preallocated mapping
+                with destination_map, memoryview(destination_map) as destination_view:
+                    xor_into(destination_view, source_view[start:start + size], self.key)
+                    destination_map.flush()
+        
+        return size
+
+    def _run_parallel(self, range_func, source_path, destination_path, size, output_size,
+                      header_size, header=b''):
+        """Preallocate the output and process every range of the file on a process pool"""
+        with open(destination_path, 'wb') as destination:
+            destination.write(header)
+            destination.truncate(output_size)
         
-        encrypted_data = self.encrypt_message(file_data)
+        ranges = [(start, min(start + PARALLEL_RANGE_SIZE, size))
+                  for start in range(0, size, PARALLEL_RANGE_SIZE)]
+        with ProcessPoolExecutor(max_workers=self._worker_count()) as pool:
+            futures = [pool.submit(range_func, self.key, source_path, destination_path,
+                                   start, end, header_size)
+                       for start, end in ranges]
+            return sum(future.result() for future in futures)
+
+    def _worker_count(self):
+        """Number of worker processes to use for parallel file encryption"""
+        return self.workers or os.cpu_count() or 1
+
+    def _use_parallel(self, size):
+        """Check whether a payload is big enough to split across workers"""
+        return size >= self.parallel_threshold and self._worker_count() > 1
+
+    def encrypt_file_parallel(self, source_path, destination_path):
+        """Encrypt a file on a process pool, returning the number of bytes read"""
+        if not self.key:
+            raise ValueError("Key not generated. Call generate_key first.")
+        
+        size = os.path.getsize(source_path)
+        header = pack_header(size)
+        return self._run_parallel(encrypt_range, source_path, destination_path,
+                                  size, len(header) + size, len(header), header)
+
+    def decrypt_file_parallel(self, source_path, destination_path):
+        """Decrypt a file on a process pool, returning the number of bytes written"""
+        if not self.key:
+            raise ValueError("Key not generated. Call generate_key first.")
+        
+        header = read_header(source_path)
+        if header is None or header['flags'] & COMPRESSION_MASK:
+            with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+                return self.decrypt_stream(source, destination)
+        
+        size = header['payload_size']
+        if os.path.getsize(source_path) < header['header_size'] + size:
+            raise ValueError("Truncated ciphertext envelope")
+        return self._run_parallel(decrypt_range, source_path, destination_path,
+                                  size, size, header['header_size'])
+
+    def _file_worth_compressing(self, source_path):
+        """Check whether compressing a file pays off, from a sample of its first bytes"""
+        if not self.compression:
+            return False
+        with open(source_path, 'rb') as source:
+            return self._worth_compressing(source.read(COMPRESS_PROBE_SIZE))
+
+    def encrypt_file_to(self, source_path, destination_path):
+        """Encrypt source_path into destination_path using the fastest available mode"""
+        size = os.path.getsize(source_path)
+        # Compressed payloads have no fixed layout, so they are always streamed;
+        # large files that would not compress take the mmap or parallel path
+        # with the same sampling decision encrypt_stream makes
+        if self._use_parallel(size) or size >= MMAP_THRESHOLD:
+            if not self._file_worth_compressing(source_path):
+                if self._use_parallel(size):
+                    return self.encrypt_file_parallel(source_path, destination_path)
+                return self.encrypt_file_mmap(source_path, destination_path)
+        with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+            return self.encrypt_stream(source, destination)
+
+    def decrypt_file_to(self, source_path, destination_path):
+        """Decrypt source_path into destination_path using the fastest available mode"""
+        header = read_header(source_path)
+        size = header['payload_size'] if header and not header['flags'] & COMPRESSION_MASK else 0
+        if self._use_parallel(size):
+            return self.decrypt_file_parallel(source_path, destination_path)
+        if size >= MMAP_THRESHOLD:
+            return self.decrypt_file_mmap(source_path, destination_path)
+        with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+            return self.decrypt_stream(source, destination)
+
+    def encrypt_file(self, file_path):
+        """Encrypt a file"""
+        if not self.key:
+            raise ValueError("Key not generated. Call generate_key first.")
         
-        # Save encrypted file
         encrypted_file_path = file_path + '.encrypted'
-        with open(encrypted_file_path, 'wb') as file:
-            file.write(encrypted_data)
+        self.encrypt_file_to(file_path, encrypted_file_path)
         
         return encrypted_file_path
 
@@ -66,14 +614,7 @@ class MessageEncryption:
         if not self.key:
             raise ValueError("Key not generated. Call generate_key first.")
         
-        with open(encrypted_file_path, 'rb') as file:
-            encrypted_data = file.read()
-        
-        decrypted_data = self.decrypt_message(encrypted_data)
-        
-        # Save decrypted file
         decrypted_file_path = encrypted_file_path.replace('.encrypted', '.decrypted')
-        with open(decrypted_file_path, 'wb') as file:
-            file.write(decrypted_data.encode())
+        self.decrypt_file_to(encrypted_file_path, decrypted_file_path)
         
-        return decrypted_file_path 
\ No newline at end of file
+        return decrypted_file_path
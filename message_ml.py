@@ -1,162 +1,427 @@
-import re
-import nltk
-import numpy as np
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.pipeline import Pipeline
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report
-import joblib
-from collections import Counter
+from collections import OrderedDict
+import hashlib
 import os
+import threading
+from itertools import islice
 
-# Download required NLTK data
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
+# NumPy, scikit-learn, joblib and NLTK are imported where they are first
+# needed, so importing this module (and starting main.py) stays cheap
+from message_stats import STATS_FILE, PersistentMessageStats
+from pattern_matcher import PATTERNS_FILE, PatternMatcher
+from text_preprocessor import TextPreprocessor
+
+# Messages classified together by analyze_messages
+ANALYSIS_BATCH_SIZE = 256
+
+# Analysis results remembered per model, least recently used evicted first
+ANALYSIS_CACHE_SIZE = 1024
+
+# Incremental training: hashed feature columns (the model holds two
+# float64 arrays of this many columns per class), messages per mini-batch
+# and mini-batches between checkpoints
+HASHING_FEATURES = 1 << 18
+TRAINING_BATCH_SIZE = 1000
+CHECKPOINT_BATCHES = 100
+
+def not_fitted_error():
+    """scikit-learn's NotFittedError, imported only once scoring has failed"""
+    from sklearn.exceptions import NotFittedError
+    return NotFittedError
 
 class MessageAnalyzer:
     def __init__(self):
         self.pipeline = None
-        self.message_stats = {
-            'total_messages': 0,
-            'avg_length': 0,
-            'common_words': Counter()
-        }
+        # What classifies messages: the pipeline, or its compact export when
+        # only scoring is needed. Loaded on first use or by warm_up.
+        self.model = None
+        self.model_lock = threading.RLock()
+        self.warm_up_thread = None
+        self._preprocessor = None
+        # Statistics across runs, in fixed memory; the snapshot is read on first use
+        self.stats_path = STATS_FILE
+        self._message_stats = None
+        
+        # (content hash, model version) -> analysis, least recently used first
+        self.analysis_cache = OrderedDict()
+        # Guards the cache and its counters; classification runs outside it,
+        # so background analysis workers can classify in parallel
+        self.cache_lock = threading.Lock()
+        self.cache_size = ANALYSIS_CACHE_SIZE
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.model_version = 0
+        
+        # Suspicious phrases, compiled once; the pattern file replaces the built-in list
+        self.patterns = PatternMatcher.load() if os.path.exists(PATTERNS_FILE) else PatternMatcher()
         
-        # Initialize or load the model
         self.model_path = 'message_classifier.joblib'
-        if os.path.exists(self.model_path):
-            self.load_model()
-        else:
-            self.initialize_model()
+    
+    @property
+    def preprocessor(self):
+        """Tokenizer shared by training and inference, reading NLTK's stopwords on first use"""
+        if self._preprocessor is None:
+            self._preprocessor = TextPreprocessor()
+        return self._preprocessor
+    
+    def _ensure_model(self):
+        """Load or initialize the model unless that has happened already"""
+        if self.model is not None:
+            return
+        with self.model_lock:
+            if self.model is not None:
+                return
+            # Prefer the fast-loading compact export
+            if self._compact_is_current():
+                self.load_compact_model()
+            elif os.path.exists(self.model_path):
+                self.load_model()
+            else:
+                self.initialize_model()
+    
+    def warm_up(self):
+        """Start loading the model on a background thread, e.g. while the user logs in"""
+        if self.model is None and self.warm_up_thread is None:
+            self.warm_up_thread = threading.Thread(target=self._warm_up, daemon=True)
+            self.warm_up_thread.start()
+        return self.warm_up_thread
+    
+    def _warm_up(self):
+        self._ensure_model()
+        # Score a message too, so the scorer's own imports are done
+        self._classify([''])
+    
+    @property
+    def compact_path(self):
+        """Compact export saved beside the joblib model"""
+        return os.path.splitext(self.model_path)[0] + '.npz'
     
     def preprocess_text(self, text):
         """Preprocess text for ML analysis"""
-        # Convert to lowercase
-        text = text.lower()
-        
-        # Remove special characters and digits
-        text = re.sub(r'[^a-zA-Z\s]', '', text)
-        
-        # Tokenize
-        tokens = nltk.word_tokenize(text)
-        
-        # Remove stopwords
-        stop_words = set(nltk.corpus.stopwords.words('english'))
-        tokens = [token for token in tokens if token not in stop_words]
-        
-        return ' '.join(tokens)
+        return self.preprocessor(text)
     
     def initialize_model(self):
         """Initialize the ML pipeline"""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        from sklearn.pipeline import Pipeline
         self.pipeline = Pipeline([
             ('tfidf', TfidfVectorizer(
                 max_features=5000,
                 ngram_range=(1, 2),
-                preprocessor=self.preprocess_text
+                preprocessor=self.preprocessor
             )),
             ('classifier', MultinomialNB())
         ])
+        self._model_changed()
+    
+    def initialize_incremental_model(self, n_features=HASHING_FEATURES):
+        """Initialize an ML pipeline that learns in mini-batches.
+        
+        The hashing vectorizer needs no vocabulary or document frequencies,
+        so batches can be learned one at a time in bounded memory.
+        """
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        from sklearn.pipeline import Pipeline
+        self.pipeline = Pipeline([
+            ('hashing', HashingVectorizer(
+                n_features=n_features,
+                ngram_range=(1, 2),
+                alternate_sign=False,
+                preprocessor=self.preprocessor
+            )),
+            ('classifier', MultinomialNB())
+        ])
+        self._model_changed()
+    
+    def is_incremental(self):
+        """Check whether the current model can learn with partial_train"""
+        self._ensure_pipeline()
+        return self.pipeline is not None and 'hashing' in self.pipeline.named_steps
+    
+    def _ensure_pipeline(self):
+        """Load the saved pipeline if only the compact export was loaded"""
+        self._ensure_model()
+        with self.model_lock:
+            if self.pipeline is None and os.path.exists(self.model_path):
+                self.load_model()
+    
+    def _model_changed(self):
+        """Classify with the current pipeline from now on"""
+        self.model = self.pipeline
+        self._invalidate_cache()
+    
+    def _invalidate_cache(self):
+        """Drop cached analyses after the model or the phrases change"""
+        with self.cache_lock:
+            self.model_version += 1
+            self.analysis_cache.clear()
     
     def train_model(self, messages, labels):
         """Train the ML model with new data"""
+        # Let a warm-up in progress finish first, so it cannot replace the new model
+        self._ensure_model()
         if not self.pipeline:
             self.initialize_model()
         
-        # Preprocess messages
-        processed_messages = [self.preprocess_text(msg) for msg in messages]
-        
-        # Train the model
-        self.pipeline.fit(processed_messages, labels)
+        # Train the model; the vectorizer preprocesses each message once
+        self.pipeline.fit(messages, labels)
+        self._model_changed()
         
         # Save the model
         self.save_model()
     
+    def partial_train(self, messages, labels):
+        """Update the model with one mini-batch, switching to an incremental model if needed"""
+        if not self.is_incremental():
+            self.initialize_incremental_model()
+        
+        classifier = self.pipeline.named_steps['classifier']
+        features = self.pipeline.named_steps['hashing'].transform(messages)
+        if hasattr(classifier, 'classes_'):
+            self._add_classes(classifier, labels)
+            classifier.partial_fit(features, labels)
+        else:
+            classifier.partial_fit(features, labels, classes=sorted(set(labels)))
+        self._model_changed()
+    
+    def _add_classes(self, classifier, labels):
+        """Give a fitted classifier empty counts for labels it has not seen"""
+        import numpy as np
+        new_classes = np.setdiff1d(np.unique(labels), classifier.classes_)
+        if not len(new_classes):
+            return
+        # partial_fit only learns its first batch's classes and silently
+        # drops any others; counts for the new ones start at zero
+        classes = np.concatenate([classifier.classes_, new_classes])
+        order = np.argsort(classes, kind='stable')
+        empty_counts = np.zeros((len(new_classes), classifier.feature_count_.shape[1]))
+        classifier.classes_ = classes[order]
+        classifier.class_count_ = np.concatenate([classifier.class_count_,
+                                                  np.zeros(len(new_classes))])[order]
+        classifier.feature_count_ = np.vstack([classifier.feature_count_, empty_counts])[order]
+    
+    def train_incremental(self, labeled_messages, batch_size=TRAINING_BATCH_SIZE,
+                          checkpoint_every=CHECKPOINT_BATCHES, on_checkpoint=None):
+        """Learn from an iterable of (message, label) pairs in mini-batches.
+        
+        Only one batch is held in memory. The model is saved every
+        checkpoint_every batches and at the end, after which
+        on_checkpoint(messages learned so far) is called. Returns the number
+        of messages learned.
+        """
+        labeled_messages = iter(labeled_messages)
+        learned = 0
+        batches = 0
+        while True:
+            batch = list(islice(labeled_messages, batch_size))
+            if not batch:
+                break
+            messages, labels = zip(*batch)
+            self.partial_train(list(messages), list(labels))
+            learned += len(batch)
+            batches += 1
+            if batches % checkpoint_every == 0:
+                self._checkpoint(learned, on_checkpoint)
+        
+        if batches % checkpoint_every:
+            self._checkpoint(learned, on_checkpoint)
+        return learned
+    
+    def _checkpoint(self, learned, on_checkpoint):
+        self.save_model()
+        if on_checkpoint:
+            on_checkpoint(learned)
+    
     def save_model(self):
         """Save the trained model"""
         if self.pipeline:
-            joblib.dump(self.pipeline, self.model_path)
+            import joblib
+            from compact_model import export_model
+            # Replace the file in one step, so a crash mid-save keeps the last checkpoint
+            temp_path = f"{self.model_path}.{os.getpid()}.tmp"
+            joblib.dump(self.pipeline, temp_path)
+            os.replace(temp_path, self.model_path)
+            export_model(self.pipeline, self.compact_path)
+    
+    def _compact_is_current(self):
+        """Check for a compact export at least as new as the joblib model"""
+        if not os.path.exists(self.compact_path):
+            return False
+        return (not os.path.exists(self.model_path) or
+                os.path.getmtime(self.compact_path) >= os.path.getmtime(self.model_path))
+    
+    def load_compact_model(self):
+        """Load the compact export for scoring, falling back to the joblib model"""
+        from compact_model import CompactModel
+        try:
+            model = CompactModel.load(self.compact_path)
+        except (OSError, ValueError, KeyError):
+            self.load_model()
+            return
+        self.pipeline = None
+        self._model_changed()
+        self.model = model
     
     def load_model(self):
         """Load a trained model"""
+        import pickle
+        import struct
+        import joblib
+        from compact_model import export_model
         try:
             self.pipeline = joblib.load(self.model_path)
-        except:
+        except (OSError, EOFError, pickle.UnpicklingError, struct.error, ValueError,
+                KeyError, IndexError, TypeError, AttributeError, ImportError):
+            # Missing, truncated or corrupt, or pickled by an incompatible scikit-learn
             self.initialize_model()
+            return
+        
+        # Models saved before TextPreprocessor point their vectorizer at an
+        # old MessageAnalyzer's preprocess_text
+        tfidf = self.pipeline.named_steps.get('tfidf')
+        if tfidf is not None and not isinstance(tfidf.preprocessor, TextPreprocessor):
+            tfidf.preprocessor = self.preprocessor
+        self._model_changed()
+        
+        # Models saved before the compact format start fast from the next run
+        if not self._compact_is_current():
+            try:
+                export_model(self.pipeline, self.compact_path)
+            except (OSError, ValueError, AttributeError):
+                # Not fitted, or a layout the compact scorer cannot reproduce
+                pass
+    
+    def load_patterns(self, path=PATTERNS_FILE):
+        """Score messages against the phrases in a pattern file"""
+        self.patterns = PatternMatcher.load(path)
+        # Cached analyses hold scores from the old phrases
+        self._invalidate_cache()
     
     def analyze_message(self, message):
         """Analyze a message using ML"""
-        if not self.pipeline:
-            self.initialize_model()
+        return self._analyze_batch([message])[0]
+    
+    def analyze_messages(self, messages, batch_size=ANALYSIS_BATCH_SIZE):
+        """Analyze many messages, yielding one result per message in order"""
+        messages = iter(messages)
+        while True:
+            batch = list(islice(messages, batch_size))
+            if not batch:
+                return
+            yield from self._analyze_batch(batch)
+    
+    def _analyze_batch(self, messages):
+        """Analyze a list of messages and count them in the statistics"""
+        results = self._cached_analyses(messages)
         
-        # Preprocess the message
-        processed_message = self.preprocess_text(message)
+        # Update message statistics
+        self._update_stats_batch(messages)
+        return results
+    
+    def _cached_analyses(self, messages):
+        """Analyses of a list of messages, classifying only those not cached"""
+        self._ensure_model()
         
-        # Get prediction probabilities
-        try:
-            probas = self.pipeline.predict_proba([processed_message])[0]
-            predicted_class = self.pipeline.classes_[np.argmax(probas)]
-            confidence = np.max(probas)
-        except:
-            # Fallback if model hasn't been trained
-            predicted_class = 'normal'
-            confidence = 0.0
+        keys = [(hashlib.sha256(message.encode('utf-8', 'surrogatepass')).digest(), self.model_version)
+                for message in messages]
+        missing = {}
+        with self.cache_lock:
+            for key, message in zip(keys, messages):
+                if key in self.analysis_cache:
+                    self.analysis_cache.move_to_end(key)
+                    self.cache_hits += 1
+                elif key not in missing:
+                    missing[key] = message
+                    self.cache_misses += 1
         
-        # Calculate suspicious score based on content
-        suspicious_score = self._calculate_suspicious_score(message)
+        classified = {}
+        if missing:
+            classified = dict(zip(missing, self._classify(list(missing.values()))))
+            with self.cache_lock:
+                self.analysis_cache.update(classified)
+                while len(self.analysis_cache) > self.cache_size:
+                    self.analysis_cache.popitem(last=False)
         
-        # Update message statistics
-        self._update_stats(message)
+        # Hits may have been evicted by another thread since the lookup
+        with self.cache_lock:
+            analyses = [classified.get(key) or self.analysis_cache.get(key) for key in keys]
+        return [dict(analysis or self._classify([message])[0])
+                for analysis, message in zip(analyses, messages)]
+    
+    def _classify(self, messages):
+        """Classify and score a list of messages with one model call"""
+        import numpy as np
+        # Get prediction probabilities for the whole batch as one sparse
+        # matrix; the vectorizer preprocesses each message once
+        try:
+            probas = self.model.predict_proba(messages)
+            predicted_classes = self.model.classes_[np.argmax(probas, axis=1)]
+            confidences = np.max(probas, axis=1)
+        except (AttributeError, not_fitted_error()):
+            # Fallback if model hasn't been trained
+            predicted_classes = ['normal'] * len(messages)
+            confidences = [0.0] * len(messages)
         
-        return {
-            'type': predicted_class,
+        return [{
+            'type': str(predicted_class),
             'confidence': float(confidence),
-            'suspicious_score': suspicious_score
+            # Calculate suspicious score based on content
+            'suspicious_score': self._calculate_suspicious_score(message)
+        } for message, predicted_class, confidence in zip(messages, predicted_classes, confidences)]
+    
+    def cache_stats(self):
+        """Analysis cache counters"""
+        with self.cache_lock:
+            hits, misses, size = self.cache_hits, self.cache_misses, len(self.analysis_cache)
+        lookups = hits + misses
+        return {
+            'size': size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'model_version': self.model_version
         }
     
     def _calculate_suspicious_score(self, message):
         """Calculate suspicious score based on content analysis"""
-        message_lower = message.lower()
-        suspicious_patterns = {
-            'spam': ['buy now', 'click here', 'free offer', 'winner', 'lottery'],
-            'sensitive': ['password', 'credit card', 'ssn', 'bank account'],
-            'threat': ['hack', 'attack', 'virus', 'malware', 'exploit']
-        }
-        
-        score = 0
-        for category, patterns in suspicious_patterns.items():
-            for pattern in patterns:
-                if pattern in message_lower:
-                    score += 1
-        
-        return score
+        # One point per distinct phrase found, in a single pass over the message
+        return self.patterns.score(message)
+    
+    def suspicious_categories(self, message):
+        """Number of distinct suspicious phrases in a message, per category"""
+        return self.patterns.category_counts(message)
     
     def _update_stats(self, message):
         """Update message statistics"""
-        self.message_stats['total_messages'] += 1
-        words = re.findall(r'\w+', message.lower())
-        self.message_stats['common_words'].update(words)
-        
-        # Update average length
-        total_length = self.message_stats['avg_length'] * (self.message_stats['total_messages'] - 1)
-        self.message_stats['avg_length'] = (total_length + len(message)) / self.message_stats['total_messages']
+        self._update_stats_batch([message])
+    
+    def _update_stats_batch(self, messages):
+        """Update message statistics with several messages at once"""
+        self.message_stats.update(messages)
+    
+    @property
+    def message_stats(self):
+        """Message statistics saved in stats_path"""
+        if self._message_stats is None:
+            with self.model_lock:
+                if self._message_stats is None:
+                    self._message_stats = PersistentMessageStats(self.stats_path)
+        return self._message_stats
     
     def get_message_stats(self):
-        """Get current message statistics"""
-        return {
-            'total_messages': self.message_stats['total_messages'],
-            'average_length': self.message_stats['avg_length'],
-            'top_words': dict(self.message_stats['common_words'].most_common(10))
-        }
+        """Get message statistics across every run"""
+        return self.message_stats.summary(10)
+    
+    def close(self):
+        """Save message statistics not yet written"""
+        if self._message_stats is not None:
+            self._message_stats.close()
     
-    def is_suspicious(self, message):
-        """Check if a message is suspicious"""
-        analysis = self.analyze_message(message)
-        return analysis['suspicious_score'] > 2 or analysis['confidence'] > 0.8 
\ No newline at end of file
+    def is_suspicious(self, message, analysis=None):
+        """Check if a message is suspicious, reusing its analysis when given"""
+        if analysis is None:
+            # A cached lookup; checking a message does not count it in the statistics
+            analysis = self._cached_analyses([message])[0]
+        # An analysis still waiting for the classifier has no confidence yet
+        return analysis['suspicious_score'] > 2 or (analysis.get('confidence') or 0) > 0.8 
\ No newline at end of file
@@ -0,0 +1,332 @@
+import heapq
+import json
+import re
+import threading
+import time
+from collections import Counter
+from operator import itemgetter
+
+from storage_writer import FileLock, LOCK_SUFFIX, write_json_atomic
+
+STATS_FILE = 'message_stats.json'
+
+# Words tracked by the top-words summary; memory stays proportional to this
+# however large the vocabulary grows
+TOP_WORDS_CAPACITY = 1000
+
+# Message counts over recent time windows: name -> (seconds, buckets)
+WINDOWS = {
+    'last_hour': (60 * 60, 60),
+    'last_day': (24 * 60 * 60, 24)
+}
+
+# Unsaved messages that trigger a snapshot to disk
+STATS_FLUSH_COUNT = 64
+
+WORD_PATTERN = re.compile(r'\w+')
+
+SNAPSHOT_FORMAT = 1
+
+
+class SpaceSaving:
+    """Space-Saving summary of the most frequent items in a stream.
+
+    Holds at most capacity items. A reported count is never below the true
+    count and overestimates it by at most the item's error, which is at
+    most (items seen) / capacity.
+    """
+
+    def __init__(self, capacity=TOP_WORDS_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # (count, item) min-heap; entries whose count is out of date are
+        # skipped when popped and dropped when the heap is rebuilt
+        self.heap = []
+
+    def add(self, item, count=1):
+        """Count count occurrences of item"""
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+        else:
+            # Replace the least counted item; the newcomer may have been it
+            # all along, so it inherits that count as its error
+            floor, evicted = self._pop_min()
+            del counts[evicted]
+            del self.errors[evicted]
+            counts[item] = floor + count
+            self.errors[item] = floor
+        heapq.heappush(self.heap, (counts[item], item))
+        if len(self.heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def update(self, items):
+        """Count every item of an iterable"""
+        for item, count in Counter(items).items():
+            self.add(item, count)
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self.heap)
+            if self.counts.get(item) == count:
+                return count, item
+
+    def _rebuild_heap(self):
+        self.heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    def floor(self):
+        """Largest count an item missing from a full summary can have"""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def most_common(self, n=None):
+        """(item, count) pairs, highest count first"""
+        if n is None:
+            return sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(n, self.counts.items(), key=itemgetter(1))
+
+    def merge(self, other):
+        """Fold another summary into this one"""
+        own_floor = self.floor()
+        other_floor = other.floor()
+        merged = [(item,
+                   self.counts.get(item, own_floor) + other.counts.get(item, other_floor),
+                   self.errors.get(item, own_floor) + other.errors.get(item, other_floor))
+                  for item in self.counts.keys() | other.counts.keys()]
+        merged = heapq.nlargest(self.capacity, merged, key=itemgetter(1))
+        self.counts = {item: count for item, count, _ in merged}
+        self.errors = {item: error for item, _, error in merged}
+        self._rebuild_heap()
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'counts': self.counts, 'errors': self.errors}
+
+    @classmethod
+    def from_dict(cls, data, capacity=TOP_WORDS_CAPACITY):
+        summary = cls(capacity)
+        summary.merge(cls._restore(data))
+        return summary
+
+    @classmethod
+    def _restore(cls, data):
+        summary = cls(data['capacity'])
+        summary.counts = dict(data['counts'])
+        summary.errors = {item: data['errors'].get(item, 0) for item in summary.counts}
+        summary._rebuild_heap()
+        return summary
+
+
+class RunningStats:
+    """Count, mean and variance of a stream of numbers (Welford's method)"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        """Include one value"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """Fold another stream's statistics into this one"""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    def variance(self):
+        """Population variance of the values seen"""
+        return self.m2 / self.count if self.count else 0.0
+
+    def stddev(self):
+        return self.variance() ** 0.5
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count = data['count']
+        stats.mean = data['mean']
+        stats.m2 = data['m2']
+        return stats
+
+
+class WindowedCounter:
+    """Events in the last `seconds`, counted in `buckets` fixed time slices.
+
+    The oldest slice ages out whole, so totals are accurate to one slice.
+    """
+
+    def __init__(self, seconds, buckets):
+        self.seconds = seconds
+        self.buckets = buckets
+        self.width = seconds / buckets
+        # Slice number (wall-clock time // width) -> events
+        self.counts = {}
+
+    def add(self, count=1, now=None):
+        """Count events happening at time now"""
+        current = int((time.time() if now is None else now) // self.width)
+        self.counts[current] = self.counts.get(current, 0) + count
+        self._expire(current)
+
+    def _expire(self, current):
+        oldest = current - self.buckets + 1
+        for bucket in [bucket for bucket in self.counts if bucket < oldest]:
+            del self.counts[bucket]
+
+    def total(self, now=None):
+        """Events within the window ending at time now"""
+        self._expire(int((time.time() if now is None else now) // self.width))
+        return sum(self.counts.values())
+
+    def merge(self, other):
+        """Fold another counter over the same window into this one"""
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def to_dict(self):
+        return {'seconds': self.seconds, 'buckets': self.buckets, 'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, data):
+        counter = cls(data['seconds'], data['buckets'])
+        counter.counts = {int(bucket): count for bucket, count in data['counts'].items()}
+        return counter
+
+
+class MessageStats:
+    """Message count, length statistics, top words and recent activity in fixed memory"""
+
+    def __init__(self, capacity=TOP_WORDS_CAPACITY, windows=WINDOWS):
+        self.lengths = RunningStats()
+        self.words = SpaceSaving(capacity)
+        self.windows = {name: WindowedCounter(seconds, buckets)
+                        for name, (seconds, buckets) in windows.items()}
+
+    def update(self, messages, now=None):
+        """Include a batch of messages"""
+        if not messages:
+            return
+        for message in messages:
+            self.lengths.add(len(message))
+        self.words.update(WORD_PATTERN.findall('\n'.join(messages).lower()))
+        for window in self.windows.values():
+            window.add(len(messages), now)
+
+    def merge(self, other):
+        """Fold another set of statistics into this one"""
+        self.lengths.merge(other.lengths)
+        self.words.merge(other.words)
+        for name, window in self.windows.items():
+            if name in other.windows:
+                window.merge(other.windows[name])
+
+    def summary(self, top=10, now=None):
+        """Totals, length statistics, top words and windowed counts"""
+        return {
+            'total_messages': self.lengths.count,
+            'average_length': self.lengths.mean,
+            'length_stddev': self.lengths.stddev(),
+            'top_words': dict(self.words.most_common(top)),
+            'recent': {name: window.total(now) for name, window in self.windows.items()}
+        }
+
+    def to_dict(self):
+        return {
+            'format': SNAPSHOT_FORMAT,
+            'lengths': self.lengths.to_dict(),
+            'words': self.words.to_dict(),
+            'windows': {name: window.to_dict() for name, window in self.windows.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data, capacity=TOP_WORDS_CAPACITY, windows=WINDOWS):
+        if data.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported message statistics format {data.get('format')}")
+        stats = cls(capacity, windows)
+        stats.lengths = RunningStats.from_dict(data['lengths'])
+        stats.words = SpaceSaving.from_dict(data['words'], capacity)
+        for name, window in data['windows'].items():
+            window = WindowedCounter.from_dict(window)
+            current = stats.windows.get(name)
+            # A window whose length or slicing changed starts over
+            if current and (current.seconds, current.buckets) == (window.seconds, window.buckets):
+                current.merge(window)
+        return stats
+
+
+class PersistentMessageStats:
+    """MessageStats snapshotted to a JSON file and shared across runs.
+
+    New messages are counted in memory and folded into the file every
+    flush_count messages and on close. Folding merges with the file under a
+    lock, so instances sharing a directory add to each other's totals.
+    """
+
+    def __init__(self, path=STATS_FILE, capacity=TOP_WORDS_CAPACITY, windows=WINDOWS,
+                 flush_count=STATS_FLUSH_COUNT):
+        self.path = path
+        self.capacity = capacity
+        self.window_specs = windows
+        self.flush_count = flush_count
+        self.file_lock = FileLock(path + LOCK_SUFFIX)
+        self.lock = threading.Lock()
+        self.saved = self._read()
+        self.pending = self._empty()
+
+    def _empty(self):
+        return MessageStats(self.capacity, self.window_specs)
+
+    def _read(self):
+        """Statistics from the snapshot file, or empty ones"""
+        try:
+            with open(self.path, 'r') as f:
+                return MessageStats.from_dict(json.load(f), self.capacity, self.window_specs)
+        except FileNotFoundError:
+            return self._empty()
+
+    def update(self, messages):
+        """Include a batch of messages, snapshotting once enough are unsaved"""
+        with self.lock:
+            self.pending.update(messages)
+            flush_now = self.pending.lengths.count >= self.flush_count
+        if flush_now:
+            self.flush()
+
+    def summary(self, top=10):
+        """Statistics across every run, including messages not yet saved"""
+        with self.lock:
+            combined = self._empty()
+            combined.merge(self.saved)
+            combined.merge(self.pending)
+        return combined.summary(top)
+
+    def flush(self):
+        """Fold unsaved messages into the snapshot file"""
+        with self.lock:
+            pending, self.pending = self.pending, self._empty()
+            with self.file_lock:
+                # Other instances may have saved since this one last read
+                saved = self._read()
+                if pending.lengths.count:
+                    saved.merge(pending)
+                    write_json_atomic(self.path, saved.to_dict())
+            self.saved = saved
+
+    def close(self):
+        """Save unsaved messages before shutdown"""
+        self.flush()
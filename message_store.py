@@ -0,0 +1,567 @@
+import base64
+import binascii
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from message_encryption import unpack_header
+from storage_writer import FileLock
+
+# Directory holding the message log segments
+LOG_DIR = "message_log"
+
+# The active segment is sealed once it grows past this size. Closing the store
+# leaves it active, so the next writer (or another running process) keeps
+# appending to it without rescanning the log.
+SEGMENT_MAX_BYTES = 64 << 20
+
+# Appends are fsynced together once this many are pending...
+FSYNC_BATCH = 32
+
+# ...or once the oldest unsynced append is this many seconds old, by a timer
+# if no further append comes along
+FSYNC_INTERVAL = 1.0
+
+# Compaction runs once this many undersized sealed segments exist
+COMPACT_MIN_SEGMENTS = 4
+
+# Record framing: body size, CRC-32 of the body, size of the JSON metadata.
+# The body is the metadata followed by the raw ciphertext. A record whose
+# metadata holds ANALYSIS_KEY instead of a seq is an encrypted analysis
+# attached to the message with that seq after it was stored.
+RECORD_HEADER = struct.Struct('>III')
+ANALYSIS_KEY = 'analysis_of'
+
+# Inbox index entry: seq, segment id, offset and size of one received message
+INBOX_ENTRY = struct.Struct('>QIQI')
+
+ACTIVE_SUFFIX = '.log'
+SEALED_SUFFIX = '.sealed'
+INBOX_DIR = 'inbox'
+INBOX_SUFFIX = '.idx'
+
+# Held while appending, sealing or compacting, so several processes can
+# share one log directory
+LOCK_FILE = 'log.lock'
+
+
+def segment_name(segment_id, suffix):
+    """File name of a log segment"""
+    return f"{segment_id:08d}{suffix}"
+
+
+def user_key(username):
+    """File-system-safe, case-preserving name for a user's index files"""
+    return username.encode('utf-8').hex()
+
+
+def encode_record(metadata, payload):
+    """Frame one record for the log"""
+    meta = json.dumps(metadata, separators=(',', ':')).encode('utf-8')
+    body = meta + payload
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body), len(meta)) + body
+
+
+def read_inbox_entries(path):
+    """Read (seq, segment id, offset, size) entries from an inbox index file"""
+    with open(path, 'rb') as file:
+        data = file.read()
+    # Ignore a partial entry left by a crash mid-append
+    data = data[:len(data) - len(data) % INBOX_ENTRY.size]
+    return list(INBOX_ENTRY.iter_unpack(data))
+
+
+def decode_record(data):
+    """Split a framed record into its metadata dict and payload"""
+    _, _, meta_size = RECORD_HEADER.unpack_from(data)
+    body = data[RECORD_HEADER.size:]
+    message = json.loads(body[:meta_size])
+    message['message'] = body[meta_size:]
+    return message
+
+
+def scan_segment(file, start=0):
+    """Yield (offset, size, metadata) for every intact record in a segment file"""
+    offset = start
+    file.seek(start)
+    while True:
+        header = file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        body_size, checksum, meta_size = RECORD_HEADER.unpack(header)
+        body = file.read(body_size)
+        # A short or corrupt record marks the end of what was durably written
+        if len(body) < body_size or zlib.crc32(body) != checksum or meta_size > body_size:
+            return
+        size = RECORD_HEADER.size + body_size
+        yield offset, size, json.loads(body[:meta_size])
+        offset += size
+
+
+def read_json_history(history_file):
+    """Read a legacy message_history.json as (timestamp, sender, receiver, payload) tuples"""
+    with open(history_file, 'r') as f:
+        history = json.load(f)
+
+    # Every message appears once as "sent" and once as "received"; only the
+    # sent copy is read so each message is imported once
+    messages = []
+    for username, entries in history.items():
+        for entry in entries:
+            if entry.get('type') != 'sent':
+                continue
+            stored_message = entry['message']
+            # Keep legacy base64 text as-is; unwrap base64 around binary envelopes
+            try:
+                payload = base64.b64decode(stored_message, validate=True)
+                if unpack_header(payload) is None:
+                    payload = stored_message.encode('ascii')
+            except (binascii.Error, ValueError):
+                payload = stored_message.encode('ascii')
+            messages.append((entry['timestamp'], username, entry['to'], payload))
+    return sorted(messages)
+
+
+class MessageStore:
+    def __init__(self, log_dir=LOG_DIR, segment_max_bytes=SEGMENT_MAX_BYTES,
+                 fsync_batch=FSYNC_BATCH, fsync_interval=FSYNC_INTERVAL):
+        self.log_dir = log_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+
+        # seq -> (segment id, offset, size)
+        self.locations = {}
+        # seq -> location of the latest analysis attached to that message
+        self.analysis_locations = {}
+        self.sealed = []
+        self.next_seq = 1
+
+        self.active_id = None
+        self.active_file = None
+        self.active_size = 0
+        self.pending_syncs = 0
+        self.oldest_unsynced = None
+        self.sync_timer = None
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.lock = FileLock(os.path.join(self.log_dir, LOCK_FILE))
+        with self.lock:
+            self.load_index()
+
+    def _path(self, segment_id, suffix):
+        return os.path.join(self.log_dir, segment_name(segment_id, suffix))
+
+    def _segments(self):
+        """List (segment id, suffix) pairs on disk in log order"""
+        segments = []
+        for name in os.listdir(self.log_dir):
+            stem, suffix = os.path.splitext(name)
+            if suffix in (ACTIVE_SUFFIX, SEALED_SUFFIX) and stem.isdigit():
+                segments.append((int(stem), suffix))
+        return sorted(segments)
+
+    def _inbox_path(self, receiver, sender=None):
+        inbox = os.path.join(self.log_dir, INBOX_DIR, user_key(receiver))
+        if sender is None:
+            return inbox
+        return os.path.join(inbox, user_key(sender) + INBOX_SUFFIX)
+
+    def _add_to_inbox(self, metadata, segment_id, offset, size):
+        """Append a message to the persistent (receiver, sender) inbox index"""
+        path = self._inbox_path(metadata['receiver'], metadata['sender'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as file:
+            file.write(INBOX_ENTRY.pack(metadata['seq'], segment_id, offset, size))
+
+    def _last_inbox_seq(self, receiver, sender):
+        """Sequence number of the newest entry in an inbox index, or 0"""
+        path = self._inbox_path(receiver, sender)
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as file:
+            end = file.seek(0, os.SEEK_END)
+            end -= end % INBOX_ENTRY.size
+            if not end:
+                return 0
+            file.seek(end - INBOX_ENTRY.size)
+            return INBOX_ENTRY.unpack(file.read(INBOX_ENTRY.size))[0]
+
+    def _catch_up_inbox(self, records):
+        """Index unsealed-segment records that a crash kept out of the inbox index"""
+        last_seqs = {}
+        for segment_id, offset, size, metadata in records:
+            if ANALYSIS_KEY in metadata:
+                continue
+            pair = (metadata['receiver'], metadata['sender'])
+            if pair not in last_seqs:
+                last_seqs[pair] = self._last_inbox_seq(*pair)
+            if metadata['seq'] > last_seqs[pair]:
+                self._add_to_inbox(metadata, segment_id, offset, size)
+
+    def _index_record(self, segment_id, offset, size, metadata):
+        if ANALYSIS_KEY in metadata:
+            # Records are indexed in log order, so a later analysis replaces an earlier one
+            self.analysis_locations[metadata[ANALYSIS_KEY]] = (segment_id, offset, size)
+            return
+        seq = metadata['seq']
+        if seq in self.locations:
+            # Left behind by a compaction interrupted before it removed its inputs
+            return
+        self.locations[seq] = (segment_id, offset, size)
+        self.next_seq = max(self.next_seq, seq + 1)
+
+    def load_index(self):
+        """Rebuild the in-memory offset index by scanning every segment"""
+        self._close_active()
+        self.locations = {}
+        self.analysis_locations = {}
+        self.sealed = []
+        self.next_seq = 1
+
+        active = None
+        unsealed = []
+        for segment_id, suffix in self._segments():
+            path = self._path(segment_id, suffix)
+            with open(path, 'rb') as file:
+                end = 0
+                for offset, size, metadata in scan_segment(file):
+                    self._index_record(segment_id, offset, size, metadata)
+                    end = offset + size
+                    if suffix == ACTIVE_SUFFIX:
+                        unsealed.append((segment_id, offset, size, metadata))
+            if suffix == SEALED_SUFFIX:
+                self.sealed.append(segment_id)
+                continue
+            # Drop a torn tail left by a crash mid-append
+            if end < os.path.getsize(path):
+                with open(path, 'r+b') as file:
+                    file.truncate(end)
+            if active is not None:
+                os.replace(self._path(active, ACTIVE_SUFFIX), self._path(active, SEALED_SUFFIX))
+                self.sealed.append(active)
+            active = segment_id
+
+        if active is None:
+            active = max(self.sealed, default=0) + 1
+        self._catch_up_inbox(unsealed)
+        self._open_active(active)
+
+    def _catch_up(self):
+        """Index records other processes added since this store last looked; call with the lock held"""
+        path = self._path(self.active_id, ACTIVE_SUFFIX)
+        try:
+            current = os.stat(path)
+        except FileNotFoundError:
+            current = None
+        if current is None or not os.path.samestat(current, os.fstat(self.active_file.fileno())):
+            # Another process sealed or removed the segment this store was
+            # appending to, and may have reused its id
+            self.load_index()
+            return
+        if current.st_size <= self.active_size:
+            return
+        with open(path, 'rb') as file:
+            for offset, size, metadata in scan_segment(file, self.active_size):
+                self._index_record(self.active_id, offset, size, metadata)
+                self.active_size = offset + size
+
+    def refresh(self):
+        """Pick up messages appended by other processes"""
+        if self.active_file is None:
+            return
+        with self.lock:
+            self._catch_up()
+
+    def _open_active(self, segment_id):
+        self.active_id = segment_id
+        self.active_file = open(self._path(segment_id, ACTIVE_SUFFIX), 'ab')
+        self.active_size = self.active_file.tell()
+
+    def append(self, sender, receiver, payload, timestamp, blob=None):
+        """Append one message to the log, returning its sequence number"""
+        with self.lock:
+            return self._append(sender, receiver, payload, timestamp, blob)
+
+    def _append(self, sender, receiver, payload, timestamp, blob):
+        # Sequence numbers and offsets must follow what other processes wrote
+        self._catch_up()
+        seq = self.next_seq
+        metadata = {
+            'seq': seq,
+            'sender': sender,
+            'receiver': receiver,
+            'timestamp': timestamp
+        }
+        if blob:
+            # The payload lives in the blob store; the record only references it
+            metadata['blob'] = blob
+        offset, size = self._write_record(metadata, payload)
+        self._add_to_inbox(metadata, self.active_id, offset, size)
+        self._after_write()
+        return seq
+
+    def _write_record(self, metadata, payload):
+        """Append and index one record, returning its (offset, size)"""
+        record = encode_record(metadata, payload)
+        offset = self.active_size
+        self.active_file.write(record)
+        self.active_file.flush()
+        self.active_size += len(record)
+        self._index_record(self.active_id, offset, len(record), metadata)
+
+        # Batch fsyncs so a burst of writes shares one disk flush
+        self.pending_syncs += 1
+        if self.oldest_unsynced is None:
+            self.oldest_unsynced = time.monotonic()
+        if self.sync_timer is None and self.fsync_interval:
+            self.sync_timer = threading.Timer(self.fsync_interval, self._sync_later)
+            self.sync_timer.daemon = True
+            self.sync_timer.start()
+        return offset, len(record)
+
+    def _after_write(self):
+        """Sync and seal as due after one or more records were written"""
+        if (self.pending_syncs >= self.fsync_batch
+                or time.monotonic() - self.oldest_unsynced >= self.fsync_interval):
+            self.sync()
+        if self.active_size >= self.segment_max_bytes:
+            self._seal()
+
+    def attach_analyses(self, analyses):
+        """Append encrypted analyses of stored messages, given as {seq: payload}"""
+        if not analyses:
+            return
+        with self.lock:
+            self._catch_up()
+            for seq, payload in analyses.items():
+                self._write_record({ANALYSIS_KEY: seq}, payload)
+            self._after_write()
+
+    def analyses_for(self, seqs):
+        """Read the latest analysis attached to each of seqs, as {seq: payload}"""
+        self.refresh()
+        analyses = {}
+        for seq in seqs:
+            if seq not in self.analysis_locations:
+                continue
+            record = self._read_at(*self.analysis_locations[seq])
+            if record is None and self.active_file is not None:
+                # Another process compacted the segment; rescan and retry
+                with self.lock:
+                    self.load_index()
+                record = self._read_at(*self.analysis_locations[seq])
+            if record is not None:
+                analyses[seq] = record['message']
+        return analyses
+
+    def sync(self):
+        """Flush pending appends to disk"""
+        if self.active_file is None or not self.pending_syncs:
+            return
+        self.active_file.flush()
+        os.fsync(self.active_file.fileno())
+        self.pending_syncs = 0
+        self.oldest_unsynced = None
+        if self.sync_timer is not None:
+            self.sync_timer.cancel()
+            self.sync_timer = None
+
+    def _sync_later(self):
+        """Timer callback: sync appends no later write or close has synced"""
+        with self.lock:
+            if self.sync_timer is threading.current_thread():
+                self.sync_timer = None
+            self.sync()
+
+    def _close_active(self):
+        if self.active_file is not None:
+            self.sync()
+            self.active_file.close()
+            self.active_file = None
+
+    def _seal_active(self):
+        self._close_active()
+        os.replace(self._path(self.active_id, ACTIVE_SUFFIX),
+                   self._path(self.active_id, SEALED_SUFFIX))
+        self.sealed.append(self.active_id)
+
+    def _needs_compaction(self):
+        small = [segment_id for segment_id in self.sealed
+                 if os.path.getsize(self._path(segment_id, SEALED_SUFFIX)) < self.segment_max_bytes]
+        return len(small) >= COMPACT_MIN_SEGMENTS
+
+    def seal(self):
+        """Seal the active segment and start a new one"""
+        with self.lock:
+            self._catch_up()
+            if not self.active_size:
+                return
+            self._seal()
+
+    def _seal(self):
+        self._seal_active()
+        self._open_active(self.active_id + 1)
+        if self._needs_compaction():
+            self._compact()
+
+    def compact(self):
+        """Merge runs of undersized sealed segments into full-size sealed segments"""
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        # Other processes may have sealed or merged segments since the index was built
+        self.sealed = [segment_id for segment_id, suffix in self._segments()
+                       if suffix == SEALED_SUFFIX]
+        groups = []
+        group = []
+        group_size = 0
+        for segment_id in self.sealed:
+            size = os.path.getsize(self._path(segment_id, SEALED_SUFFIX))
+            if group and group_size + size > self.segment_max_bytes:
+                groups.append(group)
+                group, group_size = [], 0
+            group.append(segment_id)
+            group_size += size
+        groups.append(group)
+
+        for group in groups:
+            if len(group) < 2:
+                continue
+            # Write the merged segment beside the originals and swap it in under
+            # the first id, so a crash part way leaves the old segments readable
+            merged_path = self._path(group[0], '.compacting')
+            moved = {}
+            with open(merged_path, 'wb') as merged:
+                for segment_id in group:
+                    with open(self._path(segment_id, SEALED_SUFFIX), 'rb') as file:
+                        for offset, size, metadata in scan_segment(file):
+                            if ANALYSIS_KEY not in metadata:
+                                pair = (metadata['receiver'], metadata['sender'])
+                                moved.setdefault(pair, {})[metadata['seq']] = \
+                                    (group[0], merged.tell(), size)
+                            file.seek(offset)
+                            merged.write(file.read(size))
+                merged.flush()
+                os.fsync(merged.fileno())
+            os.replace(merged_path, self._path(group[0], SEALED_SUFFIX))
+            for segment_id in group[1:]:
+                os.remove(self._path(segment_id, SEALED_SUFFIX))
+            for pair, locations in moved.items():
+                self._relocate_inbox(pair, locations)
+
+        if self.active_file is not None:
+            self.load_index()
+
+    def _relocate_inbox(self, pair, locations):
+        """Point a (receiver, sender) inbox index at records moved by compaction"""
+        path = self._inbox_path(*pair)
+        if not os.path.exists(path):
+            return
+        entries = []
+        for seq, segment_id, offset, size in read_inbox_entries(path):
+            segment_id, offset, size = locations.get(seq, (segment_id, offset, size))
+            entries.append(INBOX_ENTRY.pack(seq, segment_id, offset, size))
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(b''.join(entries))
+        os.replace(temp_path, path)
+
+    def _read_at(self, segment_id, offset, size):
+        """Read the framed record stored at a location, or None if it is gone"""
+        if segment_id == self.active_id:
+            if self.active_file is not None:
+                self.active_file.flush()
+            path = self._path(segment_id, ACTIVE_SUFFIX)
+            if not os.path.exists(path):
+                # Sealed by another process
+                path = self._path(segment_id, SEALED_SUFFIX)
+        else:
+            path = self._path(segment_id, SEALED_SUFFIX)
+        try:
+            with open(path, 'rb') as file:
+                file.seek(offset)
+                data = file.read(size)
+        except FileNotFoundError:
+            return None
+        if len(data) < RECORD_HEADER.size:
+            return None
+        body_size, checksum, _ = RECORD_HEADER.unpack_from(data)
+        body = data[RECORD_HEADER.size:]
+        if len(body) != body_size or zlib.crc32(body) != checksum:
+            return None
+        return decode_record(data)
+
+    def read(self, seq):
+        """Read one message as a dict with its metadata and raw payload"""
+        message = self._read_at(*self.locations[seq])
+        if message is None and self.active_file is not None:
+            # Another process compacted the segment; rescan and retry
+            with self.lock:
+                self.load_index()
+            message = self._read_at(*self.locations[seq])
+        return message
+
+    def inbox_senders(self, receiver):
+        """List the users who have sent messages to a receiver"""
+        inbox_dir = self._inbox_path(receiver)
+        if not os.path.isdir(inbox_dir):
+            return []
+        return sorted(bytes.fromhex(name[:-len(INBOX_SUFFIX)]).decode('utf-8')
+                      for name in os.listdir(inbox_dir) if name.endswith(INBOX_SUFFIX))
+
+    def _read_entry(self, seq, segment_id, offset, size):
+        """Read the message an inbox entry points to, or None if it is lost"""
+        message = self._read_at(segment_id, offset, size)
+        if message is None or message['seq'] != seq:
+            # The index is stale (e.g. compaction was interrupted); fall
+            # back to the offset index rebuilt at startup
+            if seq not in self.locations:
+                return None
+            message = self.read(seq)
+        return message
+
+    def inbox_page(self, receiver, sender, before=None, limit=20):
+        """Read up to limit messages from sender older than seq before, newest first"""
+        path = self._inbox_path(receiver, sender)
+        if not os.path.exists(path):
+            return []
+
+        with open(path, 'rb') as file:
+            count = file.seek(0, os.SEEK_END) // INBOX_ENTRY.size
+
+            def entry_at(index):
+                file.seek(index * INBOX_ENTRY.size)
+                return INBOX_ENTRY.unpack(file.read(INBOX_ENTRY.size))
+
+            # Entries are in seq order, so the cursor is found by binary search
+            # and only the requested page is read from the index
+            end = count
+            if before is not None:
+                low, high = 0, count
+                while low < high:
+                    middle = (low + high) // 2
+                    if entry_at(middle)[0] < before:
+                        low = middle + 1
+                    else:
+                        high = middle
+                end = low
+            entries = [entry_at(index) for index in range(end - 1, max(end - limit, 0) - 1, -1)]
+
+        messages = (self._read_entry(*entry) for entry in entries)
+        return [message for message in messages if message is not None]
+
+    def is_empty(self):
+        """Check whether the log holds no messages"""
+        return not self.locations
+
+    def close(self):
+        """Flush pending appends and close the store"""
+        if self.active_file is None:
+            return
+        with self.lock:
+            self._close_active()
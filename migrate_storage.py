@@ -0,0 +1,70 @@
+import argparse
+import shutil
+
+from storage import open_storage
+
+# Messages whose attached analyses are read and written together
+MIGRATE_BATCH_SIZE = 500
+
+
+def migrate(source, target):
+    """Copy users, messages and file metadata from one backend to another"""
+    users = source.load_users()
+    target.save_users(users)
+    activity = source.load_activity()
+    if activity:
+        target.save_activity(activity)
+
+    # Source seq -> target seq, so attached analyses follow their messages
+    seqs = {}
+    with target.transaction():
+        for message in source.iter_messages():
+            seqs[message['seq']] = target.append_message(message['sender'], message['receiver'],
+                                                         message['message'], message['timestamp'])
+    messages = len(seqs)
+    source_seqs = list(seqs)
+    for start in range(0, len(source_seqs), MIGRATE_BATCH_SIZE):
+        analyses = source.message_analyses(source_seqs[start:start + MIGRATE_BATCH_SIZE])
+        if analyses:
+            target.attach_analyses({seqs[seq]: payload for seq, payload in analyses.items()})
+
+    files = 0
+    with target.transaction():
+        for metadata in source.iter_files():
+            if metadata.get('blob'):
+                # Copy the ciphertext into the target's own blob store
+                copy_path = metadata['encrypted_path'] + '.migrating'
+                shutil.copyfile(metadata['encrypted_path'], copy_path)
+                target.add_shared_file(metadata, copy_path)
+            else:
+                target.add_file(metadata)
+            files += 1
+
+    return len(users), messages, files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate data between storage backends")
+    parser.add_argument('--from', dest='source', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--to', dest='target', choices=['json', 'sqlite'], default='sqlite')
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("Source and target backends must differ")
+
+    source = open_storage(args.source)
+    target = open_storage(args.target)
+    try:
+        if target.has_messages():
+            parser.error(f"The {args.target} backend already holds messages; refusing to duplicate them")
+        users, messages, files = migrate(source, target)
+    finally:
+        source.close()
+        target.close()
+
+    print(f"Migrated {users} users, {messages} messages and {files} files "
+          f"from {args.source} to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# scrypt cost: CPU/memory cost (a power of two), block size and parallelism.
+# n=2**14, r=8 uses 16MB and about 50ms per hash.
+SCRYPT_N = 1 << 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# PBKDF2-HMAC-SHA256 rounds, used where OpenSSL lacks scrypt
+PBKDF2_ITERATIONS = 600000
+
+SALT_SIZE = 16
+HASH_SIZE = 32
+
+SCRYPT = 'scrypt'
+PBKDF2 = 'pbkdf2_sha256'
+DEFAULT_ALGORITHM = SCRYPT if hasattr(hashlib, 'scrypt') else PBKDF2
+
+
+def b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def is_legacy_hash(encoded):
+    """Check for an unsalted SHA-256 hex digest from before costed hashing"""
+    return len(encoded) == 64 and '$' not in encoded
+
+
+def hash_password(password, algorithm=DEFAULT_ALGORITHM, scrypt_n=SCRYPT_N, scrypt_r=SCRYPT_R,
+                  scrypt_p=SCRYPT_P, pbkdf2_iterations=PBKDF2_ITERATIONS, salt=None):
+    """Hash a password with a random salt into a self-describing string.
+
+    scrypt hashes look like scrypt$n$r$p$salt$hash, PBKDF2 hashes like
+    pbkdf2_sha256$iterations$salt$hash, with base64 salt and hash.
+    """
+    salt = salt or os.urandom(SALT_SIZE)
+    if algorithm == SCRYPT:
+        derived = hashlib.scrypt(password.encode(), salt=salt, n=scrypt_n, r=scrypt_r, p=scrypt_p,
+                                 maxmem=256 * scrypt_n * scrypt_r, dklen=HASH_SIZE)
+        return f"{SCRYPT}${scrypt_n}${scrypt_r}${scrypt_p}${b64encode(salt)}${b64encode(derived)}"
+    if algorithm == PBKDF2:
+        derived = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, pbkdf2_iterations, HASH_SIZE)
+        return f"{PBKDF2}${pbkdf2_iterations}${b64encode(salt)}${b64encode(derived)}"
+    raise ValueError(f"Unknown password hashing algorithm: {algorithm}")
+
+
+def verify_password(password, encoded):
+    """Check a password against a hash made by hash_password or a legacy SHA-256 digest"""
+    if is_legacy_hash(encoded):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+
+    fields = encoded.split('$')
+    if fields[0] == SCRYPT and len(fields) == 6:
+        n, r, p = map(int, fields[1:4])
+        expected = hash_password(password, SCRYPT, scrypt_n=n, scrypt_r=r, scrypt_p=p,
+                                 salt=b64decode(fields[4]))
+    elif fields[0] == PBKDF2 and len(fields) == 4:
+        expected = hash_password(password, PBKDF2, pbkdf2_iterations=int(fields[1]),
+                                 salt=b64decode(fields[2]))
+    else:
+        raise ValueError("Unrecognized password hash format")
+    return hmac.compare_digest(expected, encoded)
+
+
+class PasswordHasher:
+    """Runs password hashing on a worker pool with tunable cost.
+
+    hashlib releases the GIL while scrypt and PBKDF2 run, so a thread pool
+    spreads concurrent logins over every core. A process pool is available
+    for interpreters where that does not hold.
+    """
+
+    def __init__(self, workers=None, algorithm=DEFAULT_ALGORITHM, scrypt_n=SCRYPT_N,
+                 scrypt_r=SCRYPT_R, scrypt_p=SCRYPT_P, pbkdf2_iterations=PBKDF2_ITERATIONS,
+                 processes=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.algorithm = algorithm
+        self.cost = {'scrypt_n': scrypt_n, 'scrypt_r': scrypt_r, 'scrypt_p': scrypt_p,
+                     'pbkdf2_iterations': pbkdf2_iterations}
+        executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=self.workers)
+
+    def submit_hash(self, password):
+        """Start hashing a password on the pool, returning a future"""
+        return self.executor.submit(hash_password, password, self.algorithm, **self.cost)
+
+    def submit_verify(self, password, encoded):
+        """Start checking a password on the pool, returning a future"""
+        return self.executor.submit(verify_password, password, encoded)
+
+    def hash(self, password):
+        """Hash a password"""
+        return self.submit_hash(password).result()
+
+    def verify(self, password, encoded):
+        """Check a password against a stored hash"""
+        return self.submit_verify(password, encoded).result()
+
+    async def hash_async(self, password):
+        """Hash a password without blocking the event loop"""
+        # Imported here; only callers already running an event loop get here
+        import asyncio
+        return await asyncio.wrap_future(self.submit_hash(password))
+
+    async def verify_async(self, password, encoded):
+        """Check a password without blocking the event loop"""
+        import asyncio
+        return await asyncio.wrap_future(self.submit_verify(password, encoded))
+
+    def needs_rehash(self, encoded):
+        """Check whether a stored hash is legacy or uses other parameters than this hasher"""
+        if is_legacy_hash(encoded):
+            return True
+        fields = encoded.split('$')
+        if fields[0] != self.algorithm:
+            return True
+        if self.algorithm == SCRYPT:
+            return list(map(int, fields[1:4])) != [self.cost['scrypt_n'], self.cost['scrypt_r'],
+                                                    self.cost['scrypt_p']]
+        return int(fields[1]) != self.cost['pbkdf2_iterations']
+
+    def close(self):
+        """Shut down the worker pool"""
+        self.executor.shutdown()
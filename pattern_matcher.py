@@ -0,0 +1,168 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from storage_writer import write_json_atomic
+
+# Phrases that raise a message's suspicious score, by category
+DEFAULT_PATTERNS = {
+    'spam': ['buy now', 'click here', 'free offer', 'winner', 'lottery'],
+    'sensitive': ['password', 'credit card', 'ssn', 'bank account'],
+    'threat': ['hack', 'attack', 'virus', 'malware', 'exploit']
+}
+
+PATTERNS_FILE = 'suspicious_patterns.json'
+CACHE_SUFFIX = '.automaton'
+
+# Bumped whenever the cached automaton layout changes
+AUTOMATON_FORMAT = 1
+
+# A phrase found in a message; start and end index message.lower()
+Match = namedtuple('Match', ['start', 'end', 'category', 'pattern'])
+
+
+def load_patterns(path=PATTERNS_FILE):
+    """Read a {category: [phrase, ...]} pattern file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        patterns = json.load(f)
+    if not isinstance(patterns, dict) or not all(isinstance(phrases, list)
+                                                 for phrases in patterns.values()):
+        raise ValueError(f"{path} must map each category to a list of phrases")
+    return patterns
+
+
+def patterns_digest(patterns):
+    """Fingerprint of a pattern set, used to tell whether a cached automaton is current"""
+    canonical = json.dumps([AUTOMATON_FORMAT, patterns], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class PatternMatcher:
+    """Aho-Corasick automaton over every phrase of every category.
+
+    Matching is case-insensitive and scans a message once, whatever the
+    number of phrases, reporting overlapping matches too.
+    """
+
+    def __init__(self, patterns=None):
+        patterns = DEFAULT_PATTERNS if patterns is None else patterns
+        self.digest = patterns_digest(patterns)
+        # Pattern id -> (category, phrase); a phrase listed twice in a category counts once
+        self.patterns = []
+        for category, phrases in patterns.items():
+            for phrase in dict.fromkeys(phrase.lower() for phrase in phrases):
+                if not phrase:
+                    raise ValueError(f"Empty pattern in category {category!r}")
+                self.patterns.append((category, phrase))
+        self.categories = list(patterns)
+        self._build()
+
+    def _build(self):
+        """Build the trie, failure links and output sets"""
+        # State -> {character: next state}; state 0 is the root
+        self.goto = [{}]
+        self.output = [[]]
+        for pattern_id, (category, phrase) in enumerate(self.patterns):
+            state = 0
+            for char in phrase:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(pattern_id)
+
+        # Breadth first, so every state's failure target is finished before it
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target
+                # A state also ends every phrase that ends at its failure target
+                self.output[next_state] = self.output[next_state] + self.output[target]
+                queue.append(next_state)
+
+    @classmethod
+    def load(cls, path=PATTERNS_FILE, cache_path=None):
+        """Matcher for a pattern file, reusing the automaton cached next to it when current"""
+        patterns = load_patterns(path)
+        cache_path = cache_path or path + CACHE_SUFFIX
+        digest = patterns_digest(patterns)
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('digest') == digest:
+                return cls._from_cache(cached)
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing or unreadable cache; rebuild it
+            pass
+
+        matcher = cls(patterns)
+        try:
+            matcher.save(cache_path)
+        except OSError:
+            # A read-only directory only costs a rebuild next time
+            pass
+        return matcher
+
+    @classmethod
+    def _from_cache(cls, cached):
+        matcher = cls.__new__(cls)
+        matcher.digest = cached['digest']
+        matcher.categories = cached['categories']
+        matcher.patterns = [tuple(pattern) for pattern in cached['patterns']]
+        matcher.goto = cached['goto']
+        matcher.fail = cached['fail']
+        matcher.output = cached['output']
+        return matcher
+
+    def save(self, cache_path):
+        """Write the compiled automaton to a cache file"""
+        write_json_atomic(cache_path, {
+            'digest': self.digest,
+            'categories': self.categories,
+            'patterns': self.patterns,
+            'goto': self.goto,
+            'fail': self.fail,
+            'output': self.output
+        })
+
+    def _scan(self, text):
+        """Yield (end, pattern ids) wherever phrases end in lowercased text"""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for end, char in enumerate(text.lower(), 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                yield end, output[state]
+
+    def found(self, text):
+        """Ids of the distinct phrases that occur in text"""
+        found = set()
+        for _, pattern_ids in self._scan(text):
+            found.update(pattern_ids)
+        return found
+
+    def matches(self, text):
+        """Every occurrence of every phrase, in order of where it ends"""
+        return [Match(end - len(self.patterns[pattern_id][1]), end, *self.patterns[pattern_id])
+                for end, pattern_ids in self._scan(text) for pattern_id in pattern_ids]
+
+    def category_counts(self, text):
+        """Number of distinct phrases found in text, per category"""
+        counts = dict.fromkeys(self.categories, 0)
+        for pattern_id in self.found(text):
+            counts[self.patterns[pattern_id][0]] += 1
+        return counts
+
+    def score(self, text):
+        """One point for each distinct phrase found in text"""
+        return len(self.found(text))
@@ -0,0 +1,131 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a session stays valid after its last use
+SESSION_TTL = 30 * 60
+
+# Live sessions kept at most; the least recently used is evicted beyond this
+SESSION_CAPACITY = 1024
+
+# Shared keys cached per session, least recently used evicted first
+KEY_CACHE_SIZE = 64
+
+
+class Session:
+    def __init__(self, username, expires_at):
+        self.username = username
+        self.expires_at = expires_at
+        # (sender, receiver) -> derived shared key
+        self.keys = OrderedDict()
+
+
+class SessionManager:
+    """In-memory session table with a sliding TTL and an LRU capacity bound.
+
+    Each session also caches the shared keys derived for the user pairs it
+    has used, so repeat sends and inbox views skip password verification and
+    key derivation.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, capacity=SESSION_CAPACITY, key_cache_size=KEY_CACHE_SIZE):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.key_cache_size = key_cache_size
+        # token -> Session, least recently used first. Every use renews the
+        # TTL, so this is also earliest expiry first.
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.key_hits = 0
+        self.key_misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expire(self, now):
+        """Drop expired sessions from the front of the table"""
+        while self.sessions:
+            token, session = next(iter(self.sessions.items()))
+            if session.expires_at > now:
+                return
+            del self.sessions[token]
+            self.expirations += 1
+
+    def create(self, username):
+        """Start a session for a user, returning its token"""
+        token = secrets.token_urlsafe(32)
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            self.sessions[token] = Session(username, now + self.ttl)
+            while len(self.sessions) > self.capacity:
+                self.sessions.popitem(last=False)
+                self.evictions += 1
+        return token
+
+    def _touch(self, token):
+        """Look up a live session and renew it; call with the lock held"""
+        now = time.monotonic()
+        self._expire(now)
+        session = self.sessions.get(token)
+        if session is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        session.expires_at = now + self.ttl
+        self.sessions.move_to_end(token)
+        return session
+
+    def validate(self, token):
+        """Username of a live session, or None if the token is unknown or expired"""
+        with self.lock:
+            session = self._touch(token)
+            return session.username if session else None
+
+    def end(self, token):
+        """End a session and forget its cached keys"""
+        with self.lock:
+            self.sessions.pop(token, None)
+
+    def get_key(self, token, sender, receiver):
+        """Shared key cached by a session for a sender and receiver, or None"""
+        with self.lock:
+            session = self._touch(token)
+            key = session.keys.get((sender, receiver)) if session else None
+            if key is None:
+                self.key_misses += 1
+                return None
+            self.key_hits += 1
+            session.keys.move_to_end((sender, receiver))
+            return key
+
+    def put_key(self, token, sender, receiver, key):
+        """Cache a verified shared key in a live session"""
+        with self.lock:
+            session = self._touch(token)
+            if session is None:
+                return
+            session.keys[(sender, receiver)] = key
+            session.keys.move_to_end((sender, receiver))
+            while len(session.keys) > self.key_cache_size:
+                session.keys.popitem(last=False)
+
+    def stats(self):
+        """Session and key cache counters"""
+        with self.lock:
+            self._expire(time.monotonic())
+            lookups = self.hits + self.misses
+            key_lookups = self.key_hits + self.key_misses
+            return {
+                'live_sessions': len(self.sessions),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'key_hits': self.key_hits,
+                'key_misses': self.key_misses,
+                'key_hit_rate': self.key_hits / key_lookups if key_lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -0,0 +1,532 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from blob_store import BlobStore
+from file_catalog import METADATA_SUFFIX, FileCatalog
+from message_store import MessageStore, read_json_history
+from storage_writer import GroupCommitWriter, write_json_atomic
+
+# Backend used when none is given; overridden by SECURE_MESSENGER_STORAGE
+DEFAULT_BACKEND = "json"
+
+USERS_FILE = "users.json"
+# Last-login times, kept apart from credentials and written behind
+ACTIVITY_FILE = "user_activity.json"
+SHARED_DIR = "shared_files"
+DATABASE_FILE = "messenger.db"
+
+# Each backend keeps its own blob store, so garbage collection in one never
+# sees the other's references as missing
+JSON_BLOB_DIR = "blobs"
+SQLITE_BLOB_DIR = "messenger_blobs"
+
+# Message payloads at least this large are kept once in the blob store and
+# referenced by digest; smaller ones are cheaper to store inline
+BLOB_INLINE_LIMIT = 4096
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    created_at TEXT,
+    last_login TEXT
+);
+CREATE TABLE IF NOT EXISTS user_activity (
+    username TEXT PRIMARY KEY,
+    last_login TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    sender TEXT NOT NULL,
+    receiver TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    blob TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_inbox ON messages (receiver, sender, timestamp);
+CREATE INDEX IF NOT EXISTS messages_pages ON messages (receiver, sender, seq);
+CREATE INDEX IF NOT EXISTS messages_sent ON messages (sender, timestamp);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sender TEXT NOT NULL,
+    receiver TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    shared_path TEXT NOT NULL UNIQUE,
+    encrypted_path TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    blob TEXT
+);
+CREATE TABLE IF NOT EXISTS message_analysis (
+    seq INTEGER PRIMARY KEY,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_receiver ON files (receiver, timestamp);
+CREATE INDEX IF NOT EXISTS files_sender ON files (sender, timestamp);
+"""
+
+# Statements are module constants so sqlite3's statement cache reuses the
+# prepared form on every call
+INSERT_USER = ("INSERT INTO users (username, password, created_at, last_login) VALUES (?, ?, ?, ?) "
+               "ON CONFLICT (username) DO UPDATE SET password = excluded.password, "
+               "created_at = excluded.created_at, last_login = excluded.last_login")
+SELECT_USERS = ("SELECT users.username, password, created_at, "
+                "COALESCE(user_activity.last_login, users.last_login) FROM users "
+                "LEFT JOIN user_activity ON user_activity.username = users.username")
+INSERT_NEW_USER = ("INSERT INTO users (username, password, created_at, last_login) "
+                   "VALUES (?, ?, ?, ?) ON CONFLICT (username) DO NOTHING")
+UPSERT_ACTIVITY = ("INSERT INTO user_activity (username, last_login) VALUES (?, ?) "
+                   "ON CONFLICT (username) DO UPDATE SET last_login = excluded.last_login")
+SELECT_ACTIVITY = "SELECT username, last_login FROM user_activity"
+INSERT_MESSAGE = ("INSERT INTO messages (sender, receiver, timestamp, payload, blob) "
+                  "VALUES (?, ?, ?, ?, ?)")
+SELECT_INBOX_SENDERS = "SELECT DISTINCT sender FROM messages WHERE receiver = ? ORDER BY sender"
+SELECT_INBOX_PAGE = ("SELECT seq, sender, receiver, timestamp, payload, blob FROM messages "
+                     "WHERE receiver = ? AND sender = ? AND seq < ? ORDER BY seq DESC LIMIT ?")
+SELECT_MESSAGES = "SELECT seq, sender, receiver, timestamp, payload, blob FROM messages ORDER BY seq"
+COUNT_MESSAGES = "SELECT EXISTS (SELECT 1 FROM messages)"
+SELECT_BLOB_REFERENCES = ("SELECT blob, COUNT(*) FROM (SELECT blob FROM messages UNION ALL "
+                          "SELECT blob FROM files) WHERE blob IS NOT NULL GROUP BY blob")
+UPSERT_ANALYSIS = "INSERT OR REPLACE INTO message_analysis (seq, payload) VALUES (?, ?)"
+SELECT_ANALYSES = "SELECT seq, payload FROM message_analysis WHERE seq IN ({})"
+INSERT_FILE = ("INSERT OR REPLACE INTO files (sender, receiver, filename, shared_path, "
+               "encrypted_path, timestamp, blob) VALUES (?, ?, ?, ?, ?, ?, ?)")
+SELECT_RECEIVED_FILES = ("SELECT sender, receiver, filename, shared_path, encrypted_path, timestamp, "
+                         "blob FROM files WHERE receiver = ? ORDER BY timestamp, id")
+SELECT_SENT_FILES = ("SELECT sender, receiver, filename, shared_path, encrypted_path, timestamp, "
+                     "blob FROM files WHERE sender = ? ORDER BY timestamp, id")
+SELECT_FILES = ("SELECT sender, receiver, filename, shared_path, encrypted_path, timestamp, blob "
+                "FROM files ORDER BY id")
+
+FILE_FIELDS = ('sender', 'receiver', 'filename', 'shared_path', 'encrypted_path', 'timestamp', 'blob')
+
+
+def open_storage(backend=None):
+    """Open the configured storage backend ("json" or "sqlite")"""
+    backend = backend or os.environ.get("SECURE_MESSENGER_STORAGE", DEFAULT_BACKEND)
+    if backend == "json":
+        return JSONStorage()
+    if backend == "sqlite":
+        return SQLiteStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+class Storage:
+    """Interface shared by the storage backends"""
+
+    blobs = None
+
+
+    def _resolve(self, message):
+        """Fill in a message's payload from the blob store if it is referenced"""
+        if message.get('blob'):
+            message['message'] = self.blobs.get(message['blob'])
+        return message
+
+    def add_shared_file(self, metadata, encrypted_path):
+        """Move an encrypted file into the blob store and record its metadata"""
+        # Like large messages, the blob stays locked until its reference is recorded
+        with self.blobs.lock:
+            digest = self.blobs.put_file(encrypted_path)
+            metadata = dict(metadata, blob=digest, encrypted_path=self.blobs.path(digest))
+            self.add_file(metadata)
+        return metadata
+
+    def blob_references(self):
+        """Count the references to each blob held by messages and files"""
+        raise NotImplementedError
+
+    def collect_garbage(self):
+        """Delete blobs nothing refers to any more, returning how many were removed"""
+        # Count references with the blob lock held. Writers hold it from
+        # storing a blob until its reference is recorded, so no blob can gain
+        # a reference between the count and the sweep.
+        with self.blobs.lock:
+            return self.blobs.collect_garbage(self.blob_references())
+
+    def load_users(self):
+        """Load all users as a dict of username -> record"""
+        raise NotImplementedError
+
+    def save_user(self, username, record):
+        """Persist one user's record"""
+        raise NotImplementedError
+
+    def add_user(self, username, record):
+        """Persist a new user's record unless the name is taken, returning whether it was stored"""
+        raise NotImplementedError
+
+    def load_activity(self):
+        """Load last-login times as a dict of username -> timestamp"""
+        raise NotImplementedError
+
+    def save_activity(self, activity):
+        """Record several users' last-login times in one write"""
+        raise NotImplementedError
+
+    def save_users(self, users):
+        """Persist every user's record"""
+        with self.transaction():
+            for username, record in users.items():
+                self.save_user(username, record)
+
+    def append_message(self, sender, receiver, payload, timestamp):
+        """Store one encrypted message, returning its sequence number"""
+        if len(payload) < BLOB_INLINE_LIMIT:
+            return self._append_message(sender, receiver, payload, timestamp, None)
+        # Kept once in the blob store and referenced by digest. The blob lock
+        # is held until the record is written, so garbage collection cannot
+        # delete the blob before its reference exists.
+        with self.blobs.lock:
+            return self._append_message(sender, receiver, b'', timestamp, self.blobs.put(payload))
+
+    def _append_message(self, sender, receiver, payload, timestamp, blob):
+        """Write one message record with an inline payload or a blob digest"""
+        raise NotImplementedError
+
+    def inbox_senders(self, receiver):
+        """List the users who have sent messages to a receiver"""
+        raise NotImplementedError
+
+    def inbox_page(self, receiver, sender, before=None, limit=20):
+        """Read up to limit messages from sender older than seq before, newest first"""
+        raise NotImplementedError
+
+    def iter_messages(self):
+        """Yield every stored message in send order"""
+        raise NotImplementedError
+
+    def attach_analyses(self, analyses):
+        """Store encrypted analyses of stored messages, given as {seq: payload}, replacing earlier ones"""
+        raise NotImplementedError
+
+    def message_analyses(self, seqs):
+        """Read the encrypted analyses attached to messages, as {seq: payload}"""
+        raise NotImplementedError
+
+    def has_messages(self):
+        """Check whether any message is stored"""
+        raise NotImplementedError
+
+    def add_file(self, metadata):
+        """Record the metadata of a shared file"""
+        raise NotImplementedError
+
+    def received_files(self, receiver):
+        """List the metadata of files shared with a user"""
+        raise NotImplementedError
+
+    def sent_files(self, sender):
+        """List the metadata of files a user has shared"""
+        raise NotImplementedError
+
+    def iter_files(self):
+        """Yield the metadata of every shared file"""
+        raise NotImplementedError
+
+    def rebuild_file_catalog(self):
+        """Rebuild the shared-files index, returning the number of files indexed"""
+        raise NotImplementedError
+
+    def verify_file_catalog(self):
+        """Check the shared-files index against the stored files, returning a list of problems"""
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        """Group several writes into one batch"""
+        yield
+
+    def import_json_history(self, history_file):
+        """Import a legacy message_history.json, returning the number of messages"""
+        messages = read_json_history(history_file)
+        with self.transaction():
+            for timestamp, sender, receiver, payload in messages:
+                self.append_message(sender, receiver, payload, timestamp)
+        return len(messages)
+
+    def close(self):
+        """Flush and release the backend"""
+
+
+class JSONStorage(Storage):
+    """Legacy backend: users.json, the message log and per-file .metadata files"""
+
+    def __init__(self, users_file=USERS_FILE, shared_dir=SHARED_DIR, message_store=None,
+                 blob_store=None, activity_file=ACTIVITY_FILE):
+        self.users_file = users_file
+        self.users_writer = GroupCommitWriter(users_file)
+        self.activity_writer = GroupCommitWriter(activity_file)
+        self.shared_dir = shared_dir
+        self.messages = message_store or MessageStore()
+        self.blobs = blob_store or BlobStore(JSON_BLOB_DIR)
+        self.catalog = FileCatalog(shared_dir)
+
+    def load_users(self):
+        users = self.users_writer.read()
+        for username, last_login in self.activity_writer.read().items():
+            if username in users:
+                users[username]['last_login'] = last_login
+        return users
+
+    def load_activity(self):
+        return self.activity_writer.read()
+
+    def save_activity(self, activity):
+        self.activity_writer.merge(activity)
+
+    def save_user(self, username, record):
+        # Only this user's record is journalled, so concurrent processes
+        # saving different users never overwrite each other
+        self.users_writer.set(username, record)
+
+    def add_user(self, username, record):
+        # Checked when the journal is flushed, so two processes registering
+        # one name cannot both succeed
+        return self.users_writer.insert(username, record)
+
+    def save_users(self, users):
+        self.users_writer.replace(dict(users))
+
+    def _append_message(self, sender, receiver, payload, timestamp, blob):
+        return self.messages.append(sender, receiver, payload, timestamp, blob)
+
+    def inbox_senders(self, receiver):
+        return self.messages.inbox_senders(receiver)
+
+    def inbox_page(self, receiver, sender, before=None, limit=20):
+        return [self._resolve(message)
+                for message in self.messages.inbox_page(receiver, sender, before, limit)]
+
+    def iter_messages(self):
+        self.messages.refresh()
+        for seq in sorted(self.messages.locations):
+            yield self._resolve(self.messages.read(seq))
+
+    def has_messages(self):
+        self.messages.refresh()
+        return not self.messages.is_empty()
+
+    def attach_analyses(self, analyses):
+        self.messages.attach_analyses(analyses)
+
+    def message_analyses(self, seqs):
+        return self.messages.analyses_for(seqs)
+
+    def add_file(self, metadata):
+        metadata = {key: value for key, value in metadata.items() if key != 'encrypted_path'}
+        os.makedirs(self.shared_dir, exist_ok=True)
+        write_json_atomic(metadata['shared_path'] + METADATA_SUFFIX, metadata)
+        self.catalog.add(os.path.basename(metadata['shared_path']) + METADATA_SUFFIX, metadata)
+
+    def _with_encrypted_path(self, name, metadata):
+        if metadata.get('blob'):
+            encrypted_path = self.blobs.path(metadata['blob'])
+        else:
+            encrypted_path = os.path.join(self.shared_dir,
+                                          name[:-len(METADATA_SUFFIX)] + '.encrypted')
+        return dict(metadata, encrypted_path=encrypted_path)
+
+    def _catalog_lookup(self, field, username):
+        return [self._with_encrypted_path(name, metadata)
+                for name, metadata in self.catalog.lookup(field, username)]
+
+    def received_files(self, receiver):
+        return self._catalog_lookup('receiver', receiver)
+
+    def sent_files(self, sender):
+        return self._catalog_lookup('sender', sender)
+
+    def iter_files(self):
+        for name, metadata in self.catalog.scan().items():
+            yield self._with_encrypted_path(name, metadata)
+
+    def rebuild_file_catalog(self):
+        return self.catalog.rebuild()
+
+    def verify_file_catalog(self):
+        problems = self.catalog.verify()
+        for metadata in self.iter_files():
+            if not os.path.exists(metadata['encrypted_path']):
+                problems.append(f"missing ciphertext for {metadata['shared_path']}")
+        return problems
+
+    def blob_references(self):
+        references = {}
+        self.messages.refresh()
+        for seq in self.messages.locations:
+            blob = self.messages.read(seq).get('blob')
+            if blob:
+                references[blob] = references.get(blob, 0) + 1
+        for metadata in self.iter_files():
+            if metadata.get('blob'):
+                references[metadata['blob']] = references.get(metadata['blob'], 0) + 1
+        return references
+
+    def close(self):
+        self.messages.close()
+
+
+class SQLiteStorage(Storage):
+    """SQLite backend in WAL mode with indexed users, messages and files tables"""
+
+    def __init__(self, database_file=DATABASE_FILE, blob_store=None):
+        self.database_file = database_file
+        self.blobs = blob_store or BlobStore(SQLITE_BLOB_DIR)
+        # One connection shared under a lock, so background flushers can use it
+        self.connection = sqlite3.connect(database_file, check_same_thread=False,
+                                          isolation_level=None, cached_statements=256)
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        """Add columns introduced after a database was created"""
+        for table in ('messages', 'files'):
+            columns = {row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")}
+            if 'blob' not in columns:
+                self.connection.execute(f"ALTER TABLE {table} ADD COLUMN blob TEXT")
+
+    @contextmanager
+    def transaction(self):
+        # Nested transactions join the outermost one, so a batch commits once
+        with self.lock:
+            if self.depth == 0:
+                self.connection.execute("BEGIN IMMEDIATE")
+            self.depth += 1
+            try:
+                yield self.connection
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.execute("ROLLBACK")
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                self.connection.execute("COMMIT")
+
+    def load_users(self):
+        with self.lock:
+            rows = self.connection.execute(SELECT_USERS).fetchall()
+        return {
+            username: {'password': password, 'created_at': created_at, 'last_login': last_login}
+            for username, password, created_at, last_login in rows
+        }
+
+    def save_user(self, username, record):
+        with self.transaction() as connection:
+            connection.execute(INSERT_USER, (username, record['password'],
+                                             record.get('created_at'), record.get('last_login')))
+
+    def add_user(self, username, record):
+        with self.transaction() as connection:
+            cursor = connection.execute(INSERT_NEW_USER, (username, record['password'],
+                                                          record.get('created_at'),
+                                                          record.get('last_login')))
+            return cursor.rowcount == 1
+
+    def load_activity(self):
+        with self.lock:
+            return dict(self.connection.execute(SELECT_ACTIVITY).fetchall())
+
+    def save_activity(self, activity):
+        with self.transaction() as connection:
+            connection.executemany(UPSERT_ACTIVITY, activity.items())
+
+    def save_users(self, users):
+        with self.transaction() as connection:
+            connection.executemany(INSERT_USER, [
+                (username, record['password'], record.get('created_at'), record.get('last_login'))
+                for username, record in users.items()
+            ])
+
+    def _append_message(self, sender, receiver, payload, timestamp, blob):
+        with self.transaction() as connection:
+            cursor = connection.execute(INSERT_MESSAGE, (sender, receiver, timestamp, payload, blob))
+            return cursor.lastrowid
+
+    def _message(self, row):
+        seq, sender, receiver, timestamp, payload, blob = row
+        return self._resolve({'seq': seq, 'sender': sender, 'receiver': receiver,
+                              'timestamp': timestamp, 'message': bytes(payload), 'blob': blob})
+
+    def inbox_senders(self, receiver):
+        with self.lock:
+            rows = self.connection.execute(SELECT_INBOX_SENDERS, (receiver,)).fetchall()
+        return [sender for sender, in rows]
+
+    def inbox_page(self, receiver, sender, before=None, limit=20):
+        # SQLite integers are 64-bit, so this bound is above every seq
+        before = (1 << 63) - 1 if before is None else before
+        with self.lock:
+            rows = self.connection.execute(SELECT_INBOX_PAGE,
+                                           (receiver, sender, before, limit)).fetchall()
+        return [self._message(row) for row in rows]
+
+    def iter_messages(self):
+        with self.lock:
+            rows = self.connection.execute(SELECT_MESSAGES).fetchall()
+        return map(self._message, rows)
+
+    def has_messages(self):
+        with self.lock:
+            return bool(self.connection.execute(COUNT_MESSAGES).fetchone()[0])
+
+    def attach_analyses(self, analyses):
+        with self.transaction() as connection:
+            connection.executemany(UPSERT_ANALYSIS, analyses.items())
+
+    def message_analyses(self, seqs):
+        seqs = list(seqs)
+        if not seqs:
+            return {}
+        with self.lock:
+            rows = self.connection.execute(SELECT_ANALYSES.format(', '.join('?' * len(seqs))),
+                                           seqs).fetchall()
+        return {seq: bytes(payload) for seq, payload in rows}
+
+    def add_file(self, metadata):
+        encrypted_path = metadata.get('encrypted_path', metadata['shared_path'] + '.encrypted')
+        with self.transaction() as connection:
+            connection.execute(INSERT_FILE, (metadata['sender'], metadata['receiver'],
+                                             metadata['filename'], metadata['shared_path'],
+                                             encrypted_path, metadata['timestamp'],
+                                             metadata.get('blob')))
+
+    def received_files(self, receiver):
+        with self.lock:
+            rows = self.connection.execute(SELECT_RECEIVED_FILES, (receiver,)).fetchall()
+        return [dict(zip(FILE_FIELDS, row)) for row in rows]
+
+    def sent_files(self, sender):
+        with self.lock:
+            rows = self.connection.execute(SELECT_SENT_FILES, (sender,)).fetchall()
+        return [dict(zip(FILE_FIELDS, row)) for row in rows]
+
+    def iter_files(self):
+        with self.lock:
+            rows = self.connection.execute(SELECT_FILES).fetchall()
+        return (dict(zip(FILE_FIELDS, row)) for row in rows)
+
+    def rebuild_file_catalog(self):
+        # The files table is the catalog; rebuilding means rebuilding its indexes
+        with self.lock:
+            self.connection.execute("REINDEX files")
+            return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def verify_file_catalog(self):
+        return [f"missing ciphertext for {metadata['shared_path']}"
+                for metadata in self.iter_files()
+                if not os.path.exists(metadata['encrypted_path'])]
+
+    def blob_references(self):
+        with self.lock:
+            return dict(self.connection.execute(SELECT_BLOB_REFERENCES).fetchall())
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
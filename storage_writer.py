@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no flock; lock the first byte of the lock file instead
+    fcntl = None
+    import msvcrt
+
+# Seconds a writer waits before flushing, so updates from other writers can
+# join the same rewrite
+GROUP_COMMIT_WINDOW = 0.005
+
+LOCK_SUFFIX = '.lock'
+JOURNAL_SUFFIX = '.journal'
+
+
+def lock_file(file):
+    """Block until an exclusive advisory lock on an open file is held"""
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK gives up after about ten seconds; keep waiting
+            continue
+
+
+def unlock_file(file):
+    """Release a lock taken with lock_file"""
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_json_atomic(path, data):
+    """Replace a JSON file in one step, so readers never see a partial write"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class FileLock:
+    """Advisory lock shared by every process using the same lock file.
+
+    The lock is re-entrant within a process, so a locked operation may call
+    other locked operations on the same file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.depth = 0
+        self.thread_lock = threading.RLock()
+
+    def acquire(self):
+        """Take the lock, waiting for other processes to release it"""
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.file = open(self.path, 'a+b')
+                lock_file(self.file)
+            except BaseException:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+
+    def release(self):
+        """Release the lock once every nested acquire has been released"""
+        self.depth -= 1
+        if self.depth == 0:
+            unlock_file(self.file)
+            self.file.close()
+            self.file = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def apply_update(document, update):
+    """Apply one journalled update to a JSON object"""
+    if 'replace' in update:
+        document.clear()
+        document.update(update['replace'])
+    elif 'merge' in update:
+        document.update(update['merge'])
+    elif 'delete' in update:
+        document.pop(update['delete'], None)
+    elif 'insert' in update:
+        # Journal order decides which of several inserts of one key wins
+        document.setdefault(update['insert'], update['value'])
+    else:
+        document[update['set']] = update['value']
+
+
+class GroupCommitWriter:
+    """Update one JSON document from many processes with few atomic rewrites.
+
+    Each update is appended to a journal beside the document. One writer at a
+    time then folds every journalled update into a single rewrite of the
+    document, so writers arriving while a flush runs share the next one
+    instead of each rewriting the file.
+    """
+
+    def __init__(self, path, window=GROUP_COMMIT_WINDOW):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.window = window
+        self.journal_lock = FileLock(self.journal_path + LOCK_SUFFIX)
+        self.flush_lock = FileLock(path + LOCK_SUFFIX)
+        # Rewrites done by this writer, for benchmarks
+        self.flushes = 0
+
+    def read(self):
+        """Read the committed document"""
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def set(self, key, value):
+        """Set one key and wait until the change is on disk"""
+        self.commit({'set': key, 'value': value})
+
+    def insert(self, key, value):
+        """Set a key the document does not have yet, returning whether this value was stored"""
+        self.commit({'insert': key, 'value': value})
+        return self.read().get(key) == value
+
+    def merge(self, values):
+        """Set several keys in one update and wait until they are on disk"""
+        self.commit({'merge': values})
+
+    def delete(self, key):
+        """Remove one key and wait until the change is on disk"""
+        self.commit({'delete': key})
+
+    def replace(self, document):
+        """Replace the whole document and wait until it is on disk"""
+        self.commit({'replace': document})
+
+    def commit(self, update):
+        """Journal an update, then wait until it has been flushed by this or another writer"""
+        # Each entry starts on a new line, so a fragment left by a crashed
+        # writer never swallows the entry after it
+        entry = '\n' + json.dumps(update, separators=(',', ':')) + '\n'
+        with self.journal_lock:
+            with open(self.journal_path, 'a') as f:
+                f.write(entry)
+
+        if self.window:
+            time.sleep(self.window)
+        with self.flush_lock:
+            self._flush()
+
+    def _read_journal(self):
+        """Read (updates, bytes read) from the journal"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        updates = []
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                updates.append(json.loads(line))
+            except ValueError:
+                # Torn by a crash mid-append
+                continue
+        return updates, len(data)
+
+    def _trim_journal(self, consumed):
+        """Drop the flushed head of the journal, keeping entries added since"""
+        with open(self.journal_path, 'rb') as f:
+            f.seek(consumed)
+            rest = f.read()
+        if not rest:
+            os.remove(self.journal_path)
+            return
+        temp_path = self.journal_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(rest)
+        os.replace(temp_path, self.journal_path)
+
+    def _flush(self):
+        """Fold every journalled update into the document; call with flush_lock held"""
+        with self.journal_lock:
+            updates, consumed = self._read_journal()
+        if not updates:
+            # Another writer's flush already included ours
+            return
+        document = self.read()
+        for update in updates:
+            apply_update(document, update)
+        write_json_atomic(self.path, document)
+        # Updates are idempotent in order, so a crash before the trim only
+        # means they are applied again by the next flush
+        with self.journal_lock:
+            self._trim_journal(consumed)
+        self.flushes += 1
@@ -0,0 +1,55 @@
+import re
+
+# Everything but ASCII letters and whitespace is dropped before tokenizing
+NON_LETTERS = re.compile(r'[^a-zA-Z\s]')
+
+# After NON_LETTERS, text is lowercase letters and whitespace, where
+# nltk.word_tokenize reduces to a whitespace split plus the Treebank
+# tokenizer's splitting of these contractions
+CONTRACTIONS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+
+def load_stop_words(language='english'):
+    """Read NLTK's stopword list for a language, downloading it on first use"""
+    from nltk.corpus import stopwords
+    try:
+        return frozenset(stopwords.words(language))
+    except LookupError:
+        import nltk
+        nltk.download('stopwords')
+        return frozenset(stopwords.words(language))
+
+
+class TextPreprocessor:
+    """Lowercases text, strips non-letters, tokenizes and removes stopwords.
+
+    Produces the same tokens as the original nltk.word_tokenize pipeline.
+    Instances are picklable, so the model's TfidfVectorizer carries its own
+    preprocessor and stopword list.
+    """
+
+    def __init__(self, stop_words=None):
+        self.stop_words = frozenset(stop_words) if stop_words is not None else load_stop_words()
+
+    def tokens(self, text):
+        """List the tokens of a text that survive stopword removal"""
+        stop_words = self.stop_words
+        tokens = []
+        for token in NON_LETTERS.sub('', text.lower()).split():
+            parts = CONTRACTIONS.get(token)
+            if parts is None:
+                if token not in stop_words:
+                    tokens.append(token)
+            else:
+                tokens.extend(part for part in parts if part not in stop_words)
+        return tokens
+
+    def __call__(self, text):
+        return ' '.join(self.tokens(text))
@@ -1,5 +1,11 @@
-from message_ml import MessageAnalyzer
+from message_ml import CHECKPOINT_BATCHES, TRAINING_BATCH_SIZE, MessageAnalyzer
+from storage_writer import write_json_atomic
+import argparse
 import json
+import os
+
+# Messages of the training file learned so far, next to the model checkpoint
+PROGRESS_SUFFIX = '.progress'
 
 def load_training_data():
     """Load or create sample training data"""
@@ -42,17 +48,68 @@ def load_training_data():
     }
     return training_data
 
+def iter_labeled_messages(path, skip=0):
+    """Stream (message, label) pairs from a JSONL file of {"message": ..., "label": ...} lines"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            if skip:
+                skip -= 1
+                continue
+            record = json.loads(line)
+            if 'message' not in record or 'label' not in record:
+                raise ValueError(f"{path}:{line_number}: expected 'message' and 'label' fields")
+            yield record['message'], record['label']
+
+def train_incremental(analyzer, path, batch_size, checkpoint_every, resume):
+    """Learn a JSONL corpus in mini-batches, resuming after the last checkpoint if asked"""
+    progress_path = analyzer.model_path + PROGRESS_SUFFIX
+    skip = 0
+    if resume and os.path.exists(progress_path):
+        with open(progress_path, 'r') as f:
+            progress = json.load(f)
+        if progress.get('source') == os.path.abspath(path) and analyzer.is_incremental():
+            skip = progress['messages']
+            print(f"Resuming after {skip} messages")
+    elif not resume:
+        analyzer.initialize_incremental_model()
+    
+    def record_progress(learned):
+        write_json_atomic(progress_path, {'source': os.path.abspath(path), 'messages': skip + learned})
+        print(f"Checkpoint: {skip + learned} messages learned")
+    
+    learned = analyzer.train_incremental(iter_labeled_messages(path, skip), batch_size=batch_size,
+                                         checkpoint_every=checkpoint_every,
+                                         on_checkpoint=record_progress)
+    return skip + learned
+
 def main():
+    parser = argparse.ArgumentParser(description="Train the message classifier")
+    parser.add_argument('--incremental', metavar='JSONL',
+                        help="Learn from a labeled JSONL file in mini-batches instead of the sample data")
+    parser.add_argument('--batch-size', type=int, default=TRAINING_BATCH_SIZE)
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_BATCHES,
+                        help="Mini-batches between model checkpoints")
+    parser.add_argument('--resume', action='store_true',
+                        help="Keep learning into the saved model; with the same file, "
+                             "skip the messages learned before the last checkpoint")
+    args = parser.parse_args()
+    
     # Initialize the analyzer
     analyzer = MessageAnalyzer()
     
-    # Load training data
-    training_data = load_training_data()
-    
     # Train the model
     print("Training the message classifier...")
-    analyzer.train_model(training_data['messages'], training_data['labels'])
-    print("Training completed!")
+    if args.incremental:
+        learned = train_incremental(analyzer, args.incremental, args.batch_size,
+                                    args.checkpoint_every, args.resume)
+        print(f"Training completed! {learned} messages learned.")
+    else:
+        # Load training data
+        training_data = load_training_data()
+        analyzer.train_model(training_data['messages'], training_data['labels'])
+        print("Training completed!")
     
     # Test the model
     print("\nTesting the model with some examples:")
@@ -64,8 +121,7 @@ def main():
         "Free iPhone! Click here to claim!"
     ]
     
-    for message in test_messages:
-        analysis = analyzer.analyze_message(message)
+    for message, analysis in zip(test_messages, analyzer.analyze_messages(test_messages)):
         print(f"\nMessage: {message}")
         print(f"Type: {analysis['type']}")
         print(f"Confidence: {analysis['confidence']:.2f}")
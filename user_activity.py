@@ -0,0 +1,53 @@
+import threading
+
+# Pending activity is written once this many updates have been recorded...
+ACTIVITY_FLUSH_COUNT = 64
+
+# ...or this many seconds after the oldest unwritten update
+ACTIVITY_FLUSH_INTERVAL = 30.0
+
+
+class ActivityTracker:
+    """Write-behind buffer for last-login times.
+
+    Logins are kept in memory and written to the storage backend's activity
+    store in one batch, so a login never rewrites the credential records.
+    """
+
+    def __init__(self, storage, flush_count=ACTIVITY_FLUSH_COUNT,
+                 flush_interval=ACTIVITY_FLUSH_INTERVAL):
+        self.storage = storage
+        self.flush_count = flush_count
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.updates = 0
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def record_login(self, username, timestamp):
+        """Note a login, writing pending logins once enough have built up"""
+        with self.lock:
+            self.pending[username] = timestamp
+            self.updates += 1
+            flush_now = self.updates >= self.flush_count
+            if not flush_now and self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """Write every pending login to storage"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.updates = 0
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if pending:
+            self.storage.save_activity(pending)
+
+    def close(self):
+        """Write pending logins before shutdown"""
+        self.flush()